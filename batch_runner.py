@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# === 路徑設定 ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MOCK_RUNNER_SRC = os.path.join(BASE_DIR, 'mock_runner.py')
+
+
+def run_script(script_path, lab, duration, distance, grace=2.0):
+    """
+    以獨立的 mock_runner.py 子行程執行單一程式 (與 server.py 相同的 Runner 邏輯)，
+    回傳精簡的評分結果 (不含完整 Log)。
+    """
+    record = {
+        "script": script_path,
+        "status": "failed",
+        "duration": None,
+        "wall_time": None,
+        "used_pins": [],
+        "log_count": 0,
+        "event_counts": {},
+        "error": None,
+    }
+    env = os.environ.copy()
+    env["MOCK_DISTANCE"] = str(distance)
+    cmd = [
+        sys.executable,
+        MOCK_RUNNER_SRC,
+        os.path.abspath(script_path),
+        '--lab', lab,
+        '--duration', str(duration),
+    ]
+
+    start = time.perf_counter()
+    # 每個程式在自己的暫存目錄執行，mock_log.json 不會互相覆蓋
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            process = subprocess.run(
+                cmd, cwd=temp_dir, env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                timeout=duration + grace,
+            )
+            stderr = process.stderr
+        except subprocess.TimeoutExpired:
+            # Runner 沒能自己在時限內結束，視為卡死
+            record["status"] = "killed"
+            record["wall_time"] = round(time.perf_counter() - start, 3)
+            record["error"] = f"Runner did not stop within {duration + grace}s"
+            return record
+        record["wall_time"] = round(time.perf_counter() - start, 3)
+
+        log_file = os.path.join(temp_dir, 'mock_log.json')
+        if not os.path.exists(log_file):
+            record["error"] = (stderr or "No log generated.").strip()[-2000:]
+            return record
+        with open(log_file, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+
+    logs = result.get("logs", [])
+    record.update({
+        "status": result.get("exit_reason", "completed"),
+        "duration": result.get("duration"),
+        "used_pins": result.get("used_pins", []),
+        "log_count": len(logs),
+        "event_counts": dict(Counter(log["action"] for log in logs)),
+        "error": result.get("error"),
+    })
+    analysis = result.get("analysis")
+    if analysis:
+        record["certain_timeout"] = analysis.get("certain_timeout", False)
+    return record
+
+
+def summarize(records, wall_time):
+    statuses = Counter(record["status"] for record in records)
+    slowest = sorted(records, key=lambda r: r["wall_time"] or 0, reverse=True)[:5]
+    return {
+        "scripts": len(records),
+        "wall_time": round(wall_time, 3),
+        "status_counts": dict(statuses),
+        "total_events": sum(record["log_count"] for record in records),
+        "slowest": [{"script": r["script"], "wall_time": r["wall_time"]} for r in slowest],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run every script in a directory through the mock runner")
+    parser.add_argument("directory", help="Directory containing student scripts")
+    parser.add_argument("--pattern", default="*.py", help="Glob pattern for scripts (default: *.py)")
+    parser.add_argument("--lab", default="unknown", help="Lab label (e.g., led, hc-sr04)")
+    parser.add_argument("--duration", type=float, default=5, help="Max simulation duration per script")
+    parser.add_argument("--distance", type=float, default=50, help="Ultrasonic distance (cm)")
+    parser.add_argument("--grace", type=float, default=2.0,
+                        help="Extra seconds before a stuck runner is killed")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel runners")
+    parser.add_argument("--output", default="batch_results.json", help="Aggregated results file")
+    args = parser.parse_args(argv)
+
+    scripts = sorted(glob.glob(os.path.join(args.directory, args.pattern)))
+    if not scripts:
+        print(f"[Batch] No scripts matching {args.pattern} in {args.directory}")
+        return 1
+
+    print(f"[Batch] Running {len(scripts)} scripts with {args.workers} workers "
+          f"(lab={args.lab}, duration={args.duration}s)")
+    start = time.perf_counter()
+    records = []
+    # 每個工作都是獨立的 Runner 子行程，因此用執行緒等待即可讓所有 CPU 核心同時運作
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {
+            pool.submit(run_script, script, args.lab, args.duration, args.distance, args.grace): script
+            for script in scripts
+        }
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            print(f"[Batch] {record['status']:<11} {record['wall_time']}s  {record['script']}")
+    wall_time = time.perf_counter() - start
+
+    records.sort(key=lambda r: r["script"])
+    summary = summarize(records, wall_time)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "results": records}, f, indent=2)
+
+    print(f"\n[Batch] {summary['scripts']} scripts in {summary['wall_time']}s")
+    for status, count in sorted(summary["status_counts"].items()):
+        print(f"  {status:<11}: {count}")
+    print(f"[Batch] Results saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
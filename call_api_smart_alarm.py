@@ -1,50 +1,369 @@
-import requests
 import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
 
 # 設定 API URL
 API_URL = "http://localhost:5050/api/simulate"
 
-# 讀取 smart_alarm.py 的程式碼
-file_path = "examples/smart_alarm.py"
-if not os.path.exists(file_path):
-    print(f"Error: {file_path} not found.")
-    exit(1)
-
-with open(file_path, "r", encoding="utf-8") as f:
-    code_content = f.read()
-
-# 設定請求參數
-payload = {
-    "code": code_content,
-    "lab": "led,buzzer,ultrasonic",  # 啟用 LED, 蜂鳴器, 超音波
-    "duration": 5,                    # 模擬 5 秒
-    "distance": 5                     # 模擬距離 5cm (危險距離，觸發警報)
-}
-
-print(f"Sending request to {API_URL}...")
-print(f"Lab: {payload['lab']}")
-print(f"Duration: {payload['duration']}s")
-print(f"Distance: {payload['distance']}cm")
-
-try:
-    response = requests.post(API_URL, json=payload)
-    
-    if response.status_code == 200:
-        result = response.json()
+# 預設工作：smart_alarm.py 在危險距離 5cm 下模擬 5 秒
+DEFAULT_JOB = "examples/smart_alarm.py;lab=led,buzzer,ultrasonic;duration=5;distance=5"
+
+
+# === 工作 (Job) 定義 ===
+def parse_job(spec):
+    """
+    解析單一工作描述字串：
+        <檔案路徑>[;lab=...][;duration=...][;distance=...][;weight=...]
+    例如：examples/hc-sr04.py;lab=hc-sr04;duration=2;distance=30;weight=3
+    """
+    parts = spec.split(";")
+    file_path = parts[0].strip()
+    options = {"lab": "unknown", "duration": 5, "distance": 50, "weight": 1}
+    for part in parts[1:]:
+        if not part.strip():
+            continue
+        key, sep, value = part.partition("=")
+        key = key.strip()
+        if not sep or key not in options:
+            raise ValueError(f"Invalid job option '{part}' in '{spec}'")
+        options[key] = value.strip() if key == "lab" else float(value)
+
+    if not os.path.exists(file_path):
+        raise ValueError(f"{file_path} not found.")
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        code_content = f.read()
+
+    payload = {
+        "code": code_content,
+        "lab": options["lab"],
+        "duration": options["duration"],
+        "distance": options["distance"],
+    }
+    return {
+        "name": os.path.basename(file_path),
+        "weight": max(options["weight"], 0.0),
+        "payload": payload,
+        # 預先序列化，避免每次請求重複 json.dumps
+        "body": json.dumps(payload).encode("utf-8"),
+    }
+
+
+# === 本地 (in-process) 伺服器 ===
+def start_local_server():
+    """在背景執行緒啟動 server.py 的 Flask app，回傳 (server, api_url)"""
+    from werkzeug.serving import make_server
+    from server import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/simulate"
+
+
+# === 統計工具 ===
+def percentile(sorted_values, pct):
+    """Nearest-rank 百分位數，sorted_values 需已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def size_stats(sizes):
+    return {
+        "min": min(sizes) if sizes else 0,
+        "avg": round(sum(sizes) / len(sizes), 1) if sizes else 0,
+        "max": max(sizes) if sizes else 0,
+        "total": sum(sizes),
+    }
+
+
+def summarize(results, wall_time):
+    """將每筆請求的結果彙整成報表用的 dict"""
+    latencies = sorted(r["latency"] for r in results)
+    ok = [r for r in results if r["ok"]]
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+
+    per_job = {}
+    for r in results:
+        job = per_job.setdefault(r["job"], {"requests": 0, "success": 0, "latencies": []})
+        job["requests"] += 1
+        job["success"] += 1 if r["ok"] else 0
+        job["latencies"].append(r["latency"])
+    for job in per_job.values():
+        values = sorted(job.pop("latencies"))
+        job["p50"] = round(percentile(values, 50), 4)
+        job["p95"] = round(percentile(values, 95), 4)
+
+    return {
+        "requests": len(results),
+        "success": len(ok),
+        "errors": len(results) - len(ok),
+        "error_breakdown": errors,
+        "wall_time": round(wall_time, 3),
+        "throughput": round(len(results) / wall_time, 3) if wall_time > 0 else 0.0,
+        "latency": {
+            "min": round(latencies[0], 4) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 4),
+            "p95": round(percentile(latencies, 95), 4),
+            "p99": round(percentile(latencies, 99), 4),
+            "max": round(latencies[-1], 4) if latencies else 0.0,
+        },
+        # 解壓縮後的回應大小，以及實際在網路上傳輸的大小 (伺服器會壓縮回應)
+        "response_bytes": size_stats([r["bytes"] for r in ok]),
+        "wire_bytes": size_stats([r["wire_bytes"] for r in ok]),
+        "log_count_total": sum(r["log_count"] for r in ok),
+        "per_job": per_job,
+    }
+
+
+def print_report(summary):
+    print("\n=== Load Test Report ===")
+    print(f"Requests   : {summary['requests']} "
+          f"(success {summary['success']}, errors {summary['errors']})")
+    print(f"Wall time  : {summary['wall_time']}s ({summary['throughput']} req/s)")
+    lat = summary["latency"]
+    print(f"Latency    : min {lat['min']}s | p50 {lat['p50']}s | p95 {lat['p95']}s "
+          f"| p99 {lat['p99']}s | max {lat['max']}s")
+    size = summary["response_bytes"]
+    print(f"Payload    : min {size['min']}B | avg {size['avg']}B | max {size['max']}B "
+          f"| total {size['total']}B")
+    wire = summary["wire_bytes"]
+    print(f"On the wire: min {wire['min']}B | avg {wire['avg']}B | max {wire['max']}B "
+          f"| total {wire['total']}B")
+    print(f"Log events : {summary['log_count_total']}")
+    if summary["error_breakdown"]:
+        print("Errors:")
+        for reason, count in sorted(summary["error_breakdown"].items()):
+            print(f"  {reason}: {count}")
+    print("Per job:")
+    for name, job in summary["per_job"].items():
+        print(f"  {name:<20} {job['success']}/{job['requests']} ok | "
+              f"p50 {job['p50']}s | p95 {job['p95']}s")
+
+
+# === 負載產生器 ===
+class LoadGenerator:
+    def __init__(self, api_url, jobs, concurrency=1, rate=None, run_time=None,
+                 max_requests=None, timeout=30, seed=None, keep_response=False):
+        self.api_url = api_url
+        self.jobs = jobs
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.run_time = run_time
+        self.max_requests = max_requests
+        self.timeout = timeout
+        # 壓測時不保留完整回應，避免長時間執行時記憶體持續成長
+        self.keep_response = keep_response
+        self.random = random.Random(seed)
+        self.weights = [job["weight"] for job in jobs]
+
+        # 共用連線池：pool_maxsize 與併發數一致，讓每個 worker 都能重用 keep-alive 連線
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Content-Type"] = "application/json"
+
+        self.lock = threading.Lock()
+        self.results = []
+        self.sent = 0
+        self.deadline = None
+        self.next_send_at = None
+
+    def _next_slot(self):
+        """
+        取得下一個發送時間點；回傳 None 代表該停止。
+        有設定 rate 時採固定間隔排程 (open-loop)，否則盡快送出 (closed-loop)。
+        """
+        with self.lock:
+            if self.max_requests is not None and self.sent >= self.max_requests:
+                return None
+            now = time.perf_counter()
+            if self.deadline is not None and now >= self.deadline:
+                return None
+            if self.rate:
+                # 落後時不重設排程，延遲一律從預定時間算起，避免 coordinated omission 低估尾端延遲
+                slot = self.next_send_at
+                self.next_send_at = slot + 1.0 / self.rate
+                if self.deadline is not None and slot >= self.deadline:
+                    return None
+            else:
+                slot = now
+            self.sent += 1
+            job = self.random.choices(self.jobs, weights=self.weights)[0]
+            return slot, job
+
+    def _send(self, job, start):
+        """:param start: 預定的發送時間 (perf_counter)，延遲由此起算"""
+        record = {"job": job["name"], "ok": False, "status": None, "latency": 0.0,
+                  "bytes": 0, "wire_bytes": 0, "log_count": 0, "error": None, "result": None}
+        try:
+            response = self.session.post(self.api_url, data=job["body"], timeout=self.timeout)
+            content = response.content
+            record["latency"] = time.perf_counter() - start
+            record["status"] = response.status_code
+            record["bytes"] = len(content)
+            # requests 會自動解壓縮；傳輸大小取 Content-Length，沒有時取實際讀到的位元組數
+            length = response.headers.get("Content-Length")
+            record["wire_bytes"] = int(length) if length and length.isdigit() else response.raw.tell()
+            if response.status_code == 200:
+                result = json.loads(content)
+                record["ok"] = True
+                record["log_count"] = len(result.get("logs", []))
+                if self.keep_response:
+                    record["result"] = result
+            else:
+                record["error"] = f"HTTP {response.status_code}"
+                if self.keep_response:
+                    record["result"] = response.text
+        except requests.exceptions.ConnectionError:
+            record["latency"] = time.perf_counter() - start
+            record["error"] = "ConnectionError"
+        except requests.exceptions.Timeout:
+            record["latency"] = time.perf_counter() - start
+            record["error"] = "Timeout"
+        except requests.exceptions.RequestException as e:
+            # 其他請求錯誤 (例如網址格式錯誤、壓縮內容解碼失敗)；MissingSchema 等也是 ValueError，必須先處理
+            record["latency"] = time.perf_counter() - start
+            record["error"] = type(e).__name__
+        except ValueError:
+            record["latency"] = time.perf_counter() - start
+            record["error"] = "InvalidJSON"
+        return record
+
+    def _worker(self):
+        while True:
+            slot = self._next_slot()
+            if slot is None:
+                return
+            send_at, job = slot
+            delay = send_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            record = self._send(job, send_at)
+            with self.lock:
+                self.results.append(record)
+
+    def run(self):
+        start = time.perf_counter()
+        self.next_send_at = start
+        if self.run_time is not None:
+            self.deadline = start + self.run_time
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            workers = [pool.submit(self._worker) for _ in range(self.concurrency)]
+        # 讓 worker 中未預期的例外浮現，而不是默默少了結果
+        for worker in workers:
+            worker.result()
+        wall_time = time.perf_counter() - start
+        self.session.close()
+        return self.results, wall_time
+
+
+def print_single_result(record):
+    """單次請求模式：保留原本顯示伺服器回應的輸出格式"""
+    if record["ok"]:
+        result = record["result"]
         print("\n=== Simulation Success ===")
         print(f"Status: {result.get('status')}")
         print(f"Used Pins: {result.get('used_pins')}")
-        print(f"Log Count: {len(result.get('logs', []))}")
-        
+        print(f"Log Count: {record['log_count']}")
+
         # 顯示前 5 筆 Log
         print("\nFirst 5 Logs:")
         for log in result.get('logs', [])[:5]:
             print(log)
+    elif record["error"] == "ConnectionError":
+        print(f"\nError: Could not connect to server at {API_URL}")
+        print("Please make sure server.py is running.")
     else:
         print("\n=== Simulation Failed ===")
-        print(f"Status Code: {response.status_code}")
-        print(response.text)
+        print(f"Status Code: {record['status']}")
+        print(record["result"] if record["result"] is not None else record["error"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for /api/simulate")
+    parser.add_argument("--job", action="append", dest="jobs",
+                        help="Job spec: <file>[;lab=..][;duration=..][;distance=..][;weight=..]"
+                             " (repeatable)")
+    parser.add_argument("--url", default=API_URL, help="Target /api/simulate URL")
+    parser.add_argument("--local", action="store_true",
+                        help="Start server.py in-process and target it")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent workers")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Target request rate (req/s); default is as fast as possible")
+    parser.add_argument("--run-time", type=float, default=None,
+                        help="Load test duration in seconds (default: send a single request)")
+    parser.add_argument("--requests", type=int, default=None, help="Max number of requests")
+    parser.add_argument("--timeout", type=float, default=30, help="Per-request timeout")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the job mix")
+    parser.add_argument("--json-out", default=None, help="Write the summary to a JSON file")
+    args = parser.parse_args()
+
+    try:
+        jobs = [parse_job(spec) for spec in (args.jobs or [DEFAULT_JOB])]
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if not any(job["weight"] > 0 for job in jobs):
+        print("Error: at least one job needs a positive weight.")
+        sys.exit(1)
+
+    local_server = None
+    if args.local:
+        local_server, API_URL = start_local_server()
+    else:
+        API_URL = args.url
+
+    # 沒有指定 run-time / requests 時維持原本的單次請求行為
+    single_shot = args.run_time is None and args.requests is None
+    max_requests = 1 if single_shot else args.requests
+
+    print(f"Sending requests to {API_URL}...")
+    for job in jobs:
+        payload = job["payload"]
+        print(f"Job {job['name']}: lab={payload['lab']} duration={payload['duration']}s "
+              f"distance={payload['distance']}cm weight={job['weight']}")
+    if not single_shot:
+        print(f"Concurrency: {args.concurrency} | Rate: {args.rate or 'max'} req/s | "
+              f"Run time: {args.run_time or '-'}s | Max requests: {args.requests or '-'}")
 
-except requests.exceptions.ConnectionError:
-    print(f"\nError: Could not connect to server at {API_URL}")
-    print("Please make sure server.py is running.")
+    generator = LoadGenerator(
+        API_URL, jobs,
+        concurrency=1 if single_shot else args.concurrency,
+        rate=args.rate,
+        run_time=args.run_time,
+        max_requests=max_requests,
+        timeout=args.timeout,
+        seed=args.seed,
+        keep_response=single_shot,
+    )
+    try:
+        results, wall_time = generator.run()
+    finally:
+        if local_server is not None:
+            local_server.shutdown()
+
+    if single_shot and results:
+        print_single_result(results[0])
+    else:
+        summary = summarize(results, wall_time)
+        print_report(summary)
+        if args.json_out:
+            with open(args.json_out, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
+            print(f"\nSummary saved to {args.json_out}")
@@ -1,6 +1,18 @@
 # devices/base.py
 class VirtualDevice:
     """所有虛擬設備的基礎類別"""
+
+    # 由 mock_runner 注入的事件紀錄函式：log_event(action, pin, value, current_time)
+    log_event = None
+    # 由 mock_runner 注入的腳位狀態表 (PinTable)：board.level(pin) 或 board.snapshot()
+    board = None
+    # 不需要逐筆記錄原始 GPIO.output 的腳位 (由設備自行輸出解碼後的事件)
+    muted_pins = frozenset()
+
+    def emit(self, action, value, current_time, pin=None):
+        """輸出設備自己的事件到模擬 Log"""
+        if self.log_event is not None:
+            self.log_event(action, pin, value, current_time)
     
     def handle_output(self, pin, value, current_time):
         """
@@ -22,4 +34,8 @@ class VirtualDevice:
         
     def handle_pwm(self, pin, value, current_time):
         """當 PWM 狀態改變時觸發 (預留擴充用)"""
-        pass
\ No newline at end of file
+        pass
+
+    def handle_finish(self, current_time):
+        """模擬結束時觸發，讓設備輸出尚未結束的狀態"""
+        pass
@@ -0,0 +1,123 @@
+import math
+import random
+from bisect import bisect_right
+
+
+class DistanceProfile:
+    """距離隨時間變化的基礎類別，t 為模擬開始後經過的秒數"""
+
+    def distance_at(self, t):
+        raise NotImplementedError
+
+
+class ConstantProfile(DistanceProfile):
+    """固定距離 (原本 HCSR04 的行為)"""
+
+    def __init__(self, distance):
+        self.distance = float(distance)
+
+    def distance_at(self, t):
+        return self.distance
+
+
+class KeyframeProfile(DistanceProfile):
+    """
+    關鍵影格距離：points 為 [(time, distance), ...]
+    interpolation = 'linear' (線性內插) 或 'step' (維持前一個值直到下一個影格)
+    第一個影格之前與最後一個影格之後維持端點值。
+    """
+
+    def __init__(self, points, interpolation="linear"):
+        if not points:
+            raise ValueError("KeyframeProfile needs at least one keyframe")
+        if interpolation not in ("linear", "step"):
+            raise ValueError(f"Unknown interpolation: {interpolation}")
+        points = sorted((float(t), float(d)) for t, d in points)
+        self.times = [t for t, _ in points]
+        self.distances = [d for _, d in points]
+        self.interpolation = interpolation
+
+    def distance_at(self, t):
+        i = bisect_right(self.times, t)
+        if i == 0:
+            return self.distances[0]
+        if i == len(self.times) or self.interpolation == "step":
+            return self.distances[i - 1]
+        t0, t1 = self.times[i - 1], self.times[i]
+        d0, d1 = self.distances[i - 1], self.distances[i]
+        return d0 + (d1 - d0) * (t - t0) / (t1 - t0)
+
+
+class PeriodicProfile(DistanceProfile):
+    """
+    週期性距離：在 center ± amplitude 之間變化
+    shape = 'sine' | 'triangle' | 'square'
+    """
+
+    def __init__(self, center, amplitude, period, shape="sine", phase=0.0):
+        if period <= 0:
+            raise ValueError("PeriodicProfile period must be positive")
+        if shape not in ("sine", "triangle", "square"):
+            raise ValueError(f"Unknown periodic shape: {shape}")
+        self.center = float(center)
+        self.amplitude = float(amplitude)
+        self.period = float(period)
+        self.shape = shape
+        self.phase = float(phase)
+
+    def distance_at(self, t):
+        x = ((t + self.phase) / self.period) % 1.0
+        if self.shape == "sine":
+            wave = math.sin(2 * math.pi * x)
+        elif self.shape == "triangle":
+            wave = 1 - 4 * abs(x - 0.25) if x < 0.75 else 4 * x - 4
+        else:
+            wave = 1.0 if x < 0.5 else -1.0
+        return self.center + self.amplitude * wave
+
+
+class NoisyProfile(DistanceProfile):
+    """在另一個 profile 上疊加高斯雜訊，seed 固定時結果可重現"""
+
+    def __init__(self, base, sigma, seed=None):
+        self.base = base
+        self.sigma = float(sigma)
+        self.random = random.Random(seed)
+
+    def distance_at(self, t):
+        return self.base.distance_at(t) + self.random.gauss(0.0, self.sigma)
+
+
+def build_profile(spec):
+    """
+    由數字或 dict 規格建立 DistanceProfile，例如：
+        50
+        {"type": "keyframes", "points": [[0, 100], [5, 5]], "interpolation": "linear"}
+        {"type": "periodic", "center": 30, "amplitude": 20, "period": 4, "shape": "sine"}
+        {"type": "noise", "base": 50, "sigma": 1.5, "seed": 42}
+    """
+    if isinstance(spec, DistanceProfile):
+        return spec
+    if isinstance(spec, (int, float)):
+        return ConstantProfile(spec)
+    if not isinstance(spec, dict):
+        raise ValueError(f"Invalid distance profile: {spec!r}")
+
+    kind = spec.get("type", "constant")
+    try:
+        if kind == "constant":
+            return ConstantProfile(spec.get("distance", 50))
+        if kind == "keyframes":
+            return KeyframeProfile(spec["points"], spec.get("interpolation", "linear"))
+        if kind == "periodic":
+            return PeriodicProfile(
+                spec["center"], spec["amplitude"], spec["period"],
+                shape=spec.get("shape", "sine"), phase=spec.get("phase", 0.0),
+            )
+        if kind == "noise":
+            return NoisyProfile(build_profile(spec.get("base", 50)), spec.get("sigma", 1.0), spec.get("seed"))
+    except KeyError as e:
+        raise ValueError(f"Distance profile '{kind}' is missing field {e}")
+    except TypeError as e:
+        raise ValueError(f"Invalid distance profile '{kind}': {e}")
+    raise ValueError(f"Unknown distance profile type: {kind}")
@@ -1,43 +1,53 @@
 import sys
 from .base import VirtualDevice
+from .distance_profile import build_profile
+
+# 公式: 距離 = (時間 * 聲速 34300) / 2  => 時間 = 距離 / 17150
+SOUND_FACTOR = 17150.0
+# TRIG 拉高後到 ECHO 開始回應的硬體延遲
+START_DELAY = 0.0001
+
 
 class HCSR04(VirtualDevice):
-    def __init__(self, trig_pin, echo_pin, distance=50):
+    def __init__(self, trig_pin, echo_pin, distance=50, start_time=None):
+        """
+        :param distance: 固定距離 (cm)，或 DistanceProfile / profile 規格 dict (見 distance_profile.build_profile)
+        :param start_time: 模擬開始時間，profile 以此為 t=0；未指定時以第一次觸發為 t=0
+        """
         self.trig_pin = trig_pin
         self.echo_pin = echo_pin
-        self.distance = distance
+        self.profile = build_profile(distance)
+        self.start_time = start_time
         self.last_trig_time = 0
+        self.last_distance = None
+        # 預先計算好的 ECHO 高電位區間 [start, end)
+        # 以 tuple 一次替換，其他執行緒讀取時不會看到只更新一半的區間
+        self.echo_window = (0.0, 0.0)
         # 除錯：確認設備已初始化
         print(f"[HCSR04] Init: Trig={trig_pin}, Echo={echo_pin}, Dist={distance}", file=sys.stderr)
 
+    @property
+    def distance(self):
+        """最近一次觸發時使用的距離 (尚未觸發時為 t=0 的距離)"""
+        if self.last_distance is None:
+            return self.profile.distance_at(0.0)
+        return self.last_distance
+
     def handle_output(self, pin, value, current_time):
-        # 偵測 TRIG 腳位是否被拉高
+        # 偵測 TRIG 腳位是否被拉高，並在此時一次算好回波區間
         if pin == self.trig_pin and value == 1:
+            if self.start_time is None:
+                self.start_time = current_time
+            distance = max(0.0, self.profile.distance_at(current_time - self.start_time))
             self.last_trig_time = current_time
-            print(f"[HCSR04] Trigger detected at {current_time:.4f}", file=sys.stderr)
+            self.last_distance = distance
+            echo_start = current_time + START_DELAY
+            self.echo_window = (echo_start, echo_start + distance / SOUND_FACTOR)
+            print(f"[HCSR04] Trigger detected at {current_time:.4f} (dist={distance:.2f}cm)", file=sys.stderr)
 
     def handle_input(self, pin, current_time):
-        # 攔截 ECHO 腳位的讀取請求
+        # 攔截 ECHO 腳位的讀取請求：只需和快取的區間比較
         if pin == self.echo_pin:
-            try:
-                # 公式: 距離 = (時間 * 聲速 34300) / 2  => 時間 = 距離 / 17150
-                pulse_width = self.distance / 17150.0
-                time_since_trig = current_time - self.last_trig_time
-                
-                # 除錯：印出計算狀態 (為了避免洗版，可以只在特定條件下印)
-                # print(f"[HCSR04] Reading Echo... delta={time_since_trig:.6f}", file=sys.stderr)
-
-                start_delay = 0.0001
-                
-                if time_since_trig < start_delay:
-                    return 0 # 還沒開始 (硬體延遲)
-                elif time_since_trig < (start_delay + pulse_width):
-                    return 1 # 回波 High
-                else:
-                    return 0 # 回波結束
-            except Exception as e:
-                # 捕捉並印出錯誤，這是找出崩潰的關鍵
-                print(f"[HCSR04] Error in handle_input: {e}", file=sys.stderr)
-                return 0
-        
-        return None
\ No newline at end of file
+            echo_start, echo_end = self.echo_window
+            return 1 if echo_start <= current_time < echo_end else 0
+        return None
@@ -0,0 +1,165 @@
+import sys
+import threading
+from .base import VirtualDevice
+
+# 段碼 (a,b,c,d,e,f,g；1=亮) 對應的字元
+SEGMENT_CHARS = {
+    (1, 1, 1, 1, 1, 1, 0): "0",
+    (0, 1, 1, 0, 0, 0, 0): "1",
+    (1, 1, 0, 1, 1, 0, 1): "2",
+    (1, 1, 1, 1, 0, 0, 1): "3",
+    (0, 1, 1, 0, 0, 1, 1): "4",
+    (1, 0, 1, 1, 0, 1, 1): "5",
+    (1, 0, 1, 1, 1, 1, 1): "6",
+    (1, 1, 1, 0, 0, 0, 0): "7",
+    (1, 1, 1, 1, 1, 1, 1): "8",
+    (1, 1, 1, 1, 0, 1, 1): "9",
+    (1, 1, 1, 0, 1, 1, 1): "A",
+    (0, 0, 1, 1, 1, 1, 1): "b",
+    (1, 0, 0, 1, 1, 1, 0): "C",
+    (0, 1, 1, 1, 1, 0, 1): "d",
+    (1, 0, 0, 1, 1, 1, 1): "E",
+    (1, 0, 0, 0, 1, 1, 1): "F",
+    (0, 0, 0, 0, 0, 0, 1): "-",
+    (0, 0, 0, 0, 0, 0, 0): " ",
+}
+
+
+def decode_segments(lit):
+    """將 8 段 (a..g, dp) 的亮滅狀態轉成字元，無法辨識時回傳 '?'"""
+    char = SEGMENT_CHARS.get(tuple(lit[:7]), "?")
+    if len(lit) > 7 and lit[7]:
+        char += "."
+    return char
+
+
+class SevenSegmentDisplay(VirtualDevice):
+    """
+    多工掃描 (multiplexed) 的多位數七段顯示器。
+    逐筆追蹤段碼與位選腳位的電位，只在畫面內容改變時輸出一筆 Display.frame 事件：
+        {"action": "Display.frame", "time": 開始時間, "value": {"text": "1234", "duration": 持續秒數}}
+    """
+
+    def __init__(self, segment_pins, digit_pins, common_anode=True, digit_active_low=None,
+                 persistence=0.05, min_frame=0.01, raw_log=False):
+        """
+        :param segment_pins: a,b,c,d,e,f,g(,dp) 的腳位
+        :param digit_pins: 位選腳位 (由左至右)
+        :param common_anode: 共陽極時段碼低電位亮，共陰極則高電位亮
+        :param digit_active_low: 位選是否低電位啟用，預設與段碼相同 (例如 clock.py 的接法)
+        :param persistence: 位選關閉後仍視為亮著的時間 (視覺暫留)，超過則該位熄滅
+        :param min_frame: 短於此時間的畫面視為掃描過程中的雜訊，併入前一幀
+        :param raw_log: 是否保留段碼/位選腳位的原始 GPIO.output Log
+        """
+        self.segment_pins = list(segment_pins)
+        self.digit_pins = list(digit_pins)
+        self.segment_on = 0 if common_anode else 1
+        if digit_active_low is None:
+            digit_active_low = common_anode
+        self.digit_on = 0 if digit_active_low else 1
+        self.persistence = persistence
+        self.min_frame = min_frame
+        if not raw_log:
+            self.muted_pins = frozenset(self.segment_pins + self.digit_pins)
+
+        self.segment_index = {pin: i for i, pin in enumerate(self.segment_pins)}
+        self.digit_index = {pin: i for i, pin in enumerate(self.digit_pins)}
+        # 目前段碼亮滅狀態 (1=亮)
+        self.lit = [0] * len(self.segment_pins)
+        # 每一位目前是否被選取、最後關閉的時間、最後顯示的字元
+        self.digit_enabled = [False] * len(self.digit_pins)
+        self.digit_off_time = [None] * len(self.digit_pins)
+        self.digit_chars = [" "] * len(self.digit_pins)
+
+        # 目前畫面與尚未輸出的幀 (延後一幀輸出，以便合併雜訊)
+        self.text = self._compose()
+        self.text_start = None
+        self.held = None
+        self.frame_count = 0
+        # 使用者程式可能在背景執行緒掃描顯示器，狀態更新需整段互斥
+        self.lock = threading.Lock()
+        print(f"[7SEG] Init: Segments={self.segment_pins}, Digits={self.digit_pins}", file=sys.stderr)
+
+    def _compose(self):
+        return "".join(self.digit_chars)
+
+    def _latch(self, index):
+        self.digit_chars[index] = decode_segments(self.lit)
+
+    def _fade(self, current_time):
+        """位選關閉超過 persistence 的位數熄滅，依熄滅時間先後更新畫面"""
+        faded = []
+        for i, off_time in enumerate(self.digit_off_time):
+            if off_time is not None and current_time - off_time > self.persistence:
+                faded.append((off_time + self.persistence, i))
+        for fade_time, i in sorted(faded):
+            self.digit_off_time[i] = None
+            self.digit_chars[i] = " "
+            self._update(fade_time)
+
+    def _update(self, current_time):
+        """畫面內容若有改變，結束目前的幀並開始新的一幀"""
+        text = self._compose()
+        if text == self.text:
+            return
+        self._close(current_time)
+        self.text = text
+        self.text_start = current_time
+
+    def _close(self, current_time):
+        if self.text_start is None:
+            return
+        duration = current_time - self.text_start
+        if self.held is not None and (duration < self.min_frame or self.held["text"] == self.text):
+            # 掃描雜訊或相同畫面：延長前一幀
+            self.held["end"] = current_time
+        elif duration >= self.min_frame:
+            self._flush()
+            self.held = {"text": self.text, "start": self.text_start, "end": current_time}
+
+    def _flush(self):
+        held = self.held
+        self.held = None
+        # 全暗的畫面不輸出
+        if held is None or not held["text"].strip():
+            return
+        self.frame_count += 1
+        duration = round(held["end"] - held["start"], 3)
+        self.emit("Display.frame", {"text": held["text"], "duration": duration}, held["start"])
+
+    def handle_output(self, pin, value, current_time):
+        if pin not in self.segment_index and pin not in self.digit_index:
+            return
+        with self.lock:
+            self._handle_level(pin, value, current_time)
+
+    def _handle_level(self, pin, value, current_time):
+        if self.text_start is None:
+            self.text_start = current_time
+        self._fade(current_time)
+
+        level = 1 if value else 0
+        if pin in self.segment_index:
+            self.lit[self.segment_index[pin]] = 1 if level == self.segment_on else 0
+            for i, enabled in enumerate(self.digit_enabled):
+                if enabled:
+                    self._latch(i)
+        else:
+            i = self.digit_index[pin]
+            enabled = level == self.digit_on
+            if enabled:
+                self.digit_off_time[i] = None
+                self._latch(i)
+            elif self.digit_enabled[i]:
+                self.digit_off_time[i] = current_time
+            self.digit_enabled[i] = enabled
+        self._update(current_time)
+
+    def handle_finish(self, current_time):
+        with self.lock:
+            if self.text_start is None:
+                return
+            self._fade(current_time)
+            self._close(current_time)
+            self._flush()
+        print(f"[7SEG] Emitted {self.frame_count} frames", file=sys.stderr)
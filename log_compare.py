@@ -0,0 +1,187 @@
+import sys
+import json
+import argparse
+from bisect import bisect_right
+
+# 各動作對應到的訊號通道
+LEVEL_ACTIONS = {"GPIO.output"}
+DUTY_ACTIONS = {"PWM.start", "PWM.ChangeDutyCycle", "PWM.stop"}
+FREQ_ACTIONS = {"PWM.init", "PWM.ChangeFrequency"}
+DISPLAY_ACTIONS = {"Display.frame"}
+
+
+def _channel(log):
+    """回傳 (通道 key, 值)；不參與比對的動作回傳 None"""
+    action = log["action"]
+    if action in LEVEL_ACTIONS:
+        return (log["pin"], "level"), (1 if log["value"] else 0)
+    if action in DUTY_ACTIONS:
+        return (log["pin"], "duty"), (0.0 if action == "PWM.stop" else float(log["value"]))
+    if action in FREQ_ACTIONS:
+        return (log["pin"], "freq"), float(log["value"])
+    if action in DISPLAY_ACTIONS:
+        return ("display", "text"), log["value"]["text"]
+    return None
+
+
+def build_timelines(logs, align_start=True, until=None):
+    """
+    將 Log 轉成各通道的轉換時間軸：{(pin, kind): ([時間...], [值...])}
+    只保留值真的有改變的事件；align_start 時以第一筆事件為 t=0。
+    """
+    offset = logs[0]["time"] if (align_start and logs) else 0.0
+    timelines = {}
+    for log in logs:
+        channel = _channel(log)
+        if channel is None:
+            continue
+        key, value = channel
+        t = log["time"] - offset
+        if until is not None and t > until:
+            break
+        times, values = timelines.setdefault(key, ([], []))
+        if values and values[-1] == value:
+            continue
+        times.append(t)
+        values.append(value)
+    return timelines
+
+
+def _values_match(kind, a, b, value_tolerance):
+    if kind in ("duty", "freq"):
+        return abs(a - b) <= value_tolerance
+    return a == b
+
+
+def compare_channel(kind, ref, cand, time_tolerance, value_tolerance):
+    """
+    以 merge (雙指標) 方式對齊兩條已排序的時間軸，時間複雜度 O(n + m)。
+    回傳 matched 數量與 missing / extra / mismatched 的事件列表。
+    """
+    ref_times, ref_values = ref
+    cand_times, cand_values = cand
+    i = j = matched = 0
+    missing, extra, mismatched = [], [], []
+    while i < len(ref_times) and j < len(cand_times):
+        tr, tc = ref_times[i], cand_times[j]
+        if tc < tr - time_tolerance:
+            extra.append({"time": round(tc, 6), "value": cand_values[j]})
+            j += 1
+        elif tr < tc - time_tolerance:
+            missing.append({"time": round(tr, 6), "value": ref_values[i]})
+            i += 1
+        else:
+            if _values_match(kind, ref_values[i], cand_values[j], value_tolerance):
+                matched += 1
+            else:
+                mismatched.append({"time": round(tr, 6), "expected": ref_values[i],
+                                   "actual": cand_values[j], "actual_time": round(tc, 6)})
+            i += 1
+            j += 1
+    missing.extend({"time": round(t, 6), "value": v} for t, v in zip(ref_times[i:], ref_values[i:]))
+    extra.extend({"time": round(t, 6), "value": v} for t, v in zip(cand_times[j:], cand_values[j:]))
+    return matched, missing, extra, mismatched
+
+
+class RunComparer:
+    """
+    以一份參考執行結果為基準，比對多份學生的執行結果。
+    參考結果的時間軸只建立一次，適合大量自動評分。
+    """
+
+    def __init__(self, reference, time_tolerance=0.05, value_tolerance=1.0, align_start=True,
+                 max_details=20):
+        self.time_tolerance = time_tolerance
+        self.value_tolerance = value_tolerance
+        self.align_start = align_start
+        self.max_details = max_details
+        self.reference_duration = reference.get("duration")
+        self.reference_lines = build_timelines(reference.get("logs", []), align_start)
+
+    def compare(self, candidate):
+        # 只比對兩者都有執行到的時間範圍
+        durations = [d for d in (self.reference_duration, candidate.get("duration")) if d is not None]
+        until = min(durations) if durations else None
+        ref_lines = self.reference_lines
+        if until is not None:
+            ref_lines = {}
+            for key, (times, values) in self.reference_lines.items():
+                end = bisect_right(times, until)
+                if end:
+                    ref_lines[key] = (times[:end], values[:end])
+        cand_lines = build_timelines(candidate.get("logs", []), self.align_start, until)
+
+        channels = {}
+        total_matched = total_events = 0
+        first_divergence = None
+        empty = ([], [])
+        for key in sorted(set(ref_lines) | set(cand_lines), key=str):
+            pin, kind = key
+            ref, cand = ref_lines.get(key, empty), cand_lines.get(key, empty)
+            matched, missing, extra, mismatched = compare_channel(
+                kind, ref, cand, self.time_tolerance, self.value_tolerance
+            )
+            events = max(len(ref[0]), len(cand[0]))
+            total_matched += matched
+            total_events += events
+            channels[f"{pin}:{kind}"] = {
+                "pin": pin,
+                "kind": kind,
+                "reference_events": len(ref[0]),
+                "candidate_events": len(cand[0]),
+                "matched": matched,
+                "score": round(matched / events, 4) if events else 1.0,
+                "missing": missing[:self.max_details],
+                "extra": extra[:self.max_details],
+                "mismatched": mismatched[:self.max_details],
+                "missing_count": len(missing),
+                "extra_count": len(extra),
+                "mismatched_count": len(mismatched),
+            }
+            for kind_name, items in (("missing", missing), ("extra", extra), ("mismatched", mismatched)):
+                if items and (first_divergence is None or items[0]["time"] < first_divergence["time"]):
+                    first_divergence = dict(items[0], pin=pin, kind=kind, type=kind_name)
+
+        return {
+            "score": round(total_matched / total_events, 4) if total_events else 1.0,
+            "match": first_divergence is None,
+            "compared_until": until,
+            "first_divergence": first_divergence,
+            "channels": channels,
+        }
+
+
+def compare_runs(reference, candidate, **options):
+    """比對兩份執行結果 (含 logs 的 dict，例如 mock_log.json)"""
+    return RunComparer(reference, **options).compare(candidate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare mock runner logs against a reference run")
+    parser.add_argument("reference", help="Reference mock_log.json")
+    parser.add_argument("candidates", nargs="+", help="Candidate mock_log.json files")
+    parser.add_argument("--time-tolerance", type=float, default=0.05, help="Allowed timing difference (s)")
+    parser.add_argument("--value-tolerance", type=float, default=1.0, help="Allowed PWM duty/frequency difference")
+    parser.add_argument("--no-align", action="store_true", help="Do not align runs on their first event")
+    args = parser.parse_args()
+
+    with open(args.reference, "r", encoding="utf-8") as f:
+        comparer = RunComparer(
+            json.load(f),
+            time_tolerance=args.time_tolerance,
+            value_tolerance=args.value_tolerance,
+            align_start=not args.no_align,
+        )
+    exit_code = 0
+    for path in args.candidates:
+        with open(path, "r", encoding="utf-8") as f:
+            report = comparer.compare(json.load(f))
+        divergence = report["first_divergence"]
+        detail = "match" if divergence is None else (
+            f"first divergence at {divergence['time']}s on {divergence['pin']}:{divergence['kind']} "
+            f"({divergence['type']})"
+        )
+        print(f"{report['score']:.3f}  {path}  {detail}")
+        if not report["match"]:
+            exit_code = 1
+    sys.exit(exit_code)
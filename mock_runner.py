@@ -2,8 +2,13 @@ import sys
 import time
 import json
 import os
+import signal
 import argparse
+import datetime
+import threading
+import itertools
 import importlib.util
+from array import array
 
 # === 匯入 Mock.GPIO 並替換系統模組 ===
 import Mock.GPIO as GPIO
@@ -11,11 +16,205 @@ sys.modules['RPi'] = type(sys)('RPi')
 sys.modules['RPi.GPIO'] = GPIO
 
 # === 全域變數 ===
-logs = []
+logs = []            # 模擬結束時由各執行緒的緩衝區合併而成 (見 flush_logs)
 start_time = time.time()
 active_devices = []  # 存放已啟用的虛擬設備
 used_pins = set()    # 存放已使用的 GPIO 腳位
+muted_pins = set()   # 由設備接手輸出事件、不記錄原始 GPIO.output 的腳位
 MAX_DURATION = None  # 儲存最大執行時間
+script_analysis = None  # 使用者程式的靜態分析結果 (script_analyzer)
+vcd_writer = None    # 啟用 --vcd 時的波形輸出 (vcd_writer.VcdWriter)
+trace_recorder = None  # 啟用 --record-trace 時記錄不確定的輸入 (trace_replay.TraceRecorder)
+trace_replayer = None  # 啟用 --replay 時依 trace 重播 (trace_replay.TraceReplayer)
+profiler = None      # 啟用 --profile 時的效能分析 (SamplingProfiler)
+
+# === 各執行緒獨立的事件緩衝區 ===
+# 使用者程式常在 threading.Thread 中驅動蜂鳴器/顯示器，主執行緒同時讀取感測器。
+# 每個執行緒寫入自己的緩衝區 (不需要全域鎖)，結束時再依時間合併。
+_thread_local = threading.local()
+_thread_buffers = []  # (執行緒編號, 執行緒名稱, [(精確時間, record), ...])
+_thread_buffers_lock = threading.Lock()
+
+def thread_buffer():
+    """取得目前執行緒的事件緩衝區，第一次使用時才註冊 (只有這裡需要鎖)"""
+    try:
+        return _thread_local.buffer
+    except AttributeError:
+        buffer = []
+        with _thread_buffers_lock:
+            _thread_buffers.append((len(_thread_buffers), threading.current_thread().name, buffer))
+        _thread_local.buffer = buffer
+        return buffer
+
+def flush_logs():
+    """
+    將所有執行緒的緩衝區依精確時間合併到 logs。
+    每個緩衝區本身大致已排序，Timsort 可直接利用這些有序區段。
+    多於一個執行緒時，每筆 record 會加上 thread 欄位 (執行緒編號)。
+    """
+    with _thread_buffers_lock:
+        buffers = [(index, name, list(buffer)) for index, name, buffer in _thread_buffers]
+    multi_thread = len(buffers) > 1
+    merged = []
+    for index, _, buffer in buffers:
+        if multi_thread:
+            for _, record in buffer:
+                record["thread"] = index
+        merged.extend(buffer)
+    merged.sort(key=lambda item: item[0])
+    logs[:] = [record for _, record in merged]
+    return [{"id": index, "name": name, "events": len(buffer)} for index, name, buffer in buffers]
+
+# 主執行緒固定為編號 0
+thread_buffer()
+
+# === 腳位狀態表 (整塊板子目前的狀態) ===
+class BoardSnapshot:
+    """某個時間點整塊板子的腳位狀態 (唯讀)，由 PinTable.snapshot() 產生"""
+
+    __slots__ = ("version", "modes", "pulls", "levels", "frequencies", "duties")
+
+    def __init__(self, version, modes, pulls, levels, frequencies, duties):
+        self.version = version
+        self.modes = modes
+        self.pulls = pulls
+        self.levels = levels
+        self.frequencies = frequencies
+        self.duties = duties
+
+    def level(self, pin):
+        """腳位電位 (0/1)；尚未輸出或讀取過時回傳 None"""
+        if 0 <= pin < len(self.levels) and self.levels[pin] != PinTable.UNSET:
+            return self.levels[pin]
+        return None
+
+    def pin(self, pin):
+        """單一腳位的狀態 dict；未使用過的腳位回傳 None"""
+        if not 0 <= pin < len(self.modes):
+            return None
+        mode, level, frequency = self.modes[pin], self.levels[pin], self.frequencies[pin]
+        if mode == PinTable.UNSET and level == PinTable.UNSET and not frequency:
+            return None
+        state = {
+            "mode": PinTable.MODE_NAMES.get(mode),
+            "pull": PinTable.PULL_NAMES.get(self.pulls[pin]),
+            "level": None if level == PinTable.UNSET else level,
+        }
+        if frequency:
+            duty = self.duties[pin]
+            state["pwm"] = {"frequency": frequency, "duty": max(duty, 0.0), "running": duty >= 0}
+        return state
+
+    def as_dict(self):
+        """所有使用過的腳位：{pin: 狀態}"""
+        states = {}
+        for pin in range(len(self.modes)):
+            state = self.pin(pin)
+            if state is not None:
+                states[pin] = state
+        return states
+
+
+class PinTable:
+    """
+    以固定型別的 array 保存每個腳位的 mode / pull / level / PWM 參數，由 GPIO Hook 即時更新。
+    設備 (VirtualDevice.board) 可直接讀取單一腳位，或以 snapshot() 取得整塊板子的狀態：
+    狀態沒有改變時回傳同一個快取物件，不必從 Log 重建。
+
+    寫入不需要鎖 (GIL 下單一 array 元素的寫入是 atomic)：寫入後更新 version，
+    snapshot() 複製前後比對 version，若期間有寫入就重新複製 (seqlock)。
+    只有擴充 array 時才需要鎖。
+    """
+
+    UNSET = -1
+    MODE_NAMES = {GPIO.OUT: "out", GPIO.IN: "in"}
+    PULL_NAMES = {GPIO.PUD_OFF: "off", GPIO.PUD_UP: "up", GPIO.PUD_DOWN: "down"}
+
+    def __init__(self, size=28):
+        # 預設涵蓋 BCM GPIO 0-27，使用更大的腳位編號時自動擴充
+        self.modes = array("b", [self.UNSET]) * size
+        self.pulls = array("b", [self.UNSET]) * size
+        self.levels = array("b", [self.UNSET]) * size
+        self.frequencies = array("d", [0.0]) * size
+        self.duties = array("d", [-1.0]) * size  # 小於 0 代表 PWM 未啟動
+        # next() 本身是 atomic，多個執行緒同時寫入也不會得到相同的 version
+        self._versions = itertools.count(1)
+        self.version = 0
+        self.grow_lock = threading.Lock()
+        self._snapshot = None
+
+    def reserve(self, max_pin):
+        """依靜態分析得到的最大腳位預先配置，執行中不需再擴充"""
+        self._grow(max_pin)
+
+    def _grow(self, pin):
+        if pin < len(self.duties):
+            return
+        with self.grow_lock:
+            missing = pin + 1 - len(self.duties)
+            if missing <= 0:
+                return  # 其他執行緒已經擴充過
+            # duties 最後擴充，其他執行緒看到 duties 夠長時其他 array 也一定夠長
+            for table, fill in ((self.modes, self.UNSET), (self.pulls, self.UNSET),
+                                (self.levels, self.UNSET), (self.frequencies, 0.0),
+                                (self.duties, -1.0)):
+                table.extend([fill] * missing)
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+        self._grow(pin)
+        # 多個欄位的寫入前後都更新 version，讀取端才能偵測到寫到一半的狀態
+        self.version = next(self._versions)
+        self.modes[pin] = mode
+        self.pulls[pin] = GPIO.PUD_OFF if pull_up_down is None else pull_up_down
+        if initial is not None and mode == GPIO.OUT:
+            self.levels[pin] = 1 if initial else 0
+        self.version = next(self._versions)
+
+    def set_level(self, pin, value):
+        level = 1 if value else 0
+        # 忙碌輪詢時大多讀到相同的值，不需要更新 version
+        if pin < len(self.levels) and self.levels[pin] == level:
+            return
+        self._grow(pin)
+        self.levels[pin] = level
+        self.version = next(self._versions)
+
+    def set_pwm(self, pin, frequency=None, duty=None):
+        self._grow(pin)
+        self.version = next(self._versions)
+        if frequency is not None:
+            self.frequencies[pin] = frequency
+        if duty is not None:
+            self.duties[pin] = duty
+        self.version = next(self._versions)
+
+    def level(self, pin):
+        """單一腳位目前的電位 (0/1)；尚未輸出或讀取過時回傳 None"""
+        if 0 <= pin < len(self.levels) and self.levels[pin] != self.UNSET:
+            return self.levels[pin]
+        return None
+
+    def snapshot(self):
+        while True:
+            version = self.version
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            snapshot = BoardSnapshot(
+                version, self.modes[:], self.pulls[:], self.levels[:],
+                self.frequencies[:], self.duties[:],
+            )
+            if self.version == version:
+                self._snapshot = snapshot
+                return snapshot
+
+board = PinTable()
+
+def board_pins(pin):
+    """GPIO 函式的 pin 參數可以是單一腳位或 list/tuple，只保留有效的整數腳位"""
+    pins = pin if isinstance(pin, (list, tuple)) else (pin,)
+    return [p for p in pins if isinstance(p, int) and p >= 0]
+
 
 # === 超時檢查函式 ===
 def check_timeout():
@@ -29,36 +228,190 @@ def check_timeout():
 original_sleep = time.sleep
 def hb_sleep(seconds):
     check_timeout() # 睡前檢查
-    original_sleep(seconds)
+    if profiler is not None:
+        # 啟用 --profile 時直接量測睡眠時間
+        begin = original_time_funcs["perf_counter"]()
+        original_sleep(seconds)
+        profiler.record_sleep(original_time_funcs["perf_counter"]() - begin)
+    else:
+        original_sleep(seconds)
     check_timeout() # 睡醒檢查
 time.sleep = hb_sleep
 
+# === 錄製 / 重播 (--record-trace / --replay) ===
+# 所有讀取目前時間的函式都要經過錄製/重播，否則重播時 (不真的等待) 會走上不同的執行路徑
+TRACED_CLOCKS = ("time", "monotonic", "perf_counter")
+original_time_funcs = {name: getattr(time, name) for name in TRACED_CLOCKS + (
+    "time_ns", "monotonic_ns", "perf_counter_ns", "localtime", "gmtime", "ctime", "asctime", "strftime")}
+original_datetime = datetime.datetime
+
+def traced_clock(kind):
+    """錄製時記下每次時鐘讀值；重播時依序讀回錄製的值"""
+    if trace_replayer is not None:
+        return trace_replayer.clock(kind)
+    now = original_time_funcs[kind]()
+    trace_recorder.clock(now, kind)
+    return now
+
+def clock_bases():
+    """各時鐘在模擬開始 (start_time) 時的值"""
+    elapsed = original_time_funcs["time"]() - start_time
+    return {kind: original_time_funcs[kind]() - elapsed for kind in TRACED_CLOCKS}
+
+def _current(convert):
+    # 沒有傳入時間時改用 (可錄製/重播的) 目前時間，例如 clock.py 的 localtime()
+    def traced(value=None):
+        return convert(time.time() if value is None else value)
+    return traced
+
+TRACED_TIME_FUNCS = {
+    "time": lambda: traced_clock("time"),
+    "monotonic": lambda: traced_clock("monotonic"),
+    "perf_counter": lambda: traced_clock("perf_counter"),
+    "time_ns": lambda: int(traced_clock("time") * 1e9),
+    "monotonic_ns": lambda: int(traced_clock("monotonic") * 1e9),
+    "perf_counter_ns": lambda: int(traced_clock("perf_counter") * 1e9),
+    "localtime": _current(original_time_funcs["localtime"]),
+    "gmtime": _current(original_time_funcs["gmtime"]),
+    "ctime": _current(original_time_funcs["ctime"]),
+    "asctime": lambda t=None: original_time_funcs["asctime"](time.localtime() if t is None else t),
+    "strftime": lambda format, t=None: original_time_funcs["strftime"](
+        format, time.localtime() if t is None else t),
+}
+
+class TracedDatetime(datetime.datetime):
+    """datetime.now() / utcnow() / today() 改用可錄製/重播的 time.time()"""
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.fromtimestamp(time.time(), tz)
+
+    @classmethod
+    def utcnow(cls):
+        return cls.fromtimestamp(time.time(), datetime.timezone.utc).replace(tzinfo=None)
+
+    @classmethod
+    def today(cls):
+        return cls.fromtimestamp(time.time())
+
+def virtual_sleep(seconds):
+    """重播時不需要真的等待，經過的時間由 trace 中的時鐘讀值決定"""
+    pass
+
+def install_trace_hooks():
+    global original_sleep
+    for name, func in TRACED_TIME_FUNCS.items():
+        setattr(time, name, func)
+    datetime.datetime = TracedDatetime
+    if trace_replayer is not None:
+        original_sleep = virtual_sleep
+
+def remove_trace_hooks():
+    for name, func in original_time_funcs.items():
+        setattr(time, name, func)
+    datetime.datetime = original_datetime
+
+# === 靜態分析 ===
+def load_script_analysis(target_file, source=None):
+    """取得使用者程式的靜態分析結果：優先使用 Server 傳入的結果，否則自行分析"""
+    analysis_json = os.environ.get("MOCK_SCRIPT_ANALYSIS")
+    if analysis_json:
+        return json.loads(analysis_json)
+    try:
+        from script_analyzer import analyze_source
+        if source is None:
+            with open(target_file, "r", encoding="utf-8") as f:
+                source = f.read()
+        return analyze_source(source)
+    except (ImportError, OSError):
+        return None
+
+def pins_match(outputs=(), inputs=()):
+    """
+    依靜態分析判斷程式是否使用了設備需要的腳位。
+    回傳 True/False；沒有分析結果或有無法解析的腳位時回傳 None (未知)
+    """
+    if script_analysis is None or script_analysis.get("unresolved_pins", True):
+        return None
+    pins = script_analysis.get("pins", {})
+    used_out = set(pins.get("setup_out", [])) | set(pins.get("output", [])) | set(pins.get("pwm", []))
+    used_in = set(pins.get("setup_in", [])) | set(pins.get("input", []))
+    return set(outputs) <= used_out and set(inputs) <= used_in
+
+def should_load(requested, match, auto_detect=False):
+    """lab 有指定時一定載入 (靜態分析只是推測)；未指定 lab 時才依腳位自動載入"""
+    return requested or (auto_detect and match is True)
+
 # === 設備初始化邏輯 ===
 def setup_devices(lab_label):
-    """根據 lab 標籤載入對應的虛擬設備"""
+    """根據 lab 標籤與靜態分析的腳位載入對應的虛擬設備"""
+    auto_detect = lab_label == 'unknown'
     # 從環境變數讀取距離設定，預設 50cm
     dist = float(os.environ.get("MOCK_DISTANCE", 50))
+    # 若有設定 MOCK_DISTANCE_PROFILE (JSON)，則改用隨時間變化的距離
+    profile_json = os.environ.get("MOCK_DISTANCE_PROFILE")
+    if profile_json:
+        from devices.distance_profile import build_profile
+        try:
+            spec = json.loads(profile_json)
+            build_profile(spec)
+            dist = spec
+        except ValueError as e:  # json.JSONDecodeError 也是 ValueError
+            # 設定錯誤時改用固定距離，讓模擬照常執行並寫出 Log
+            print(f"[MockRunner] Invalid MOCK_DISTANCE_PROFILE ({e}), using distance={dist}cm", file=sys.stderr)
     # print(lab_label) # Debug用，可註解
-    if 'hc-sr04' in lab_label or 'ultrasonic' in lab_label:
+    requested = 'hc-sr04' in lab_label or 'ultrasonic' in lab_label
+    match = pins_match(outputs=(27,), inputs=(22,))
+    if should_load(requested, match, auto_detect):
         from devices.hc_sr04 import HCSR04
         # 這裡假設腳位是 TRIG=27, ECHO=22 (對應你的 hc-sr04.py)
-        device = HCSR04(trig_pin=27, echo_pin=22, distance=dist)
+        device = HCSR04(trig_pin=27, echo_pin=22, distance=dist, start_time=start_time)
+        active_devices.append(device)
+        # profile 也可以是單純的數字 (固定距離)
+        print(f"[MockRunner] Loaded HC-SR04 (profile={dist.get('type', 'constant')})" if isinstance(dist, dict)
+              else f"[MockRunner] Loaded HC-SR04 (dist={dist}cm)")
+
+    # 預設腳位對應 examples/clock.py，可用 MOCK_7SEG (JSON) 覆寫
+    config = {
+        "segment_pins": [2, 3, 4, 17, 27, 22, 10, 9],
+        "digit_pins": [11, 5, 6, 13],
+        "common_anode": True,
+    }
+    config.update(json.loads(os.environ.get("MOCK_7SEG", "{}")))
+    requested = '4seg' in lab_label or '7seg' in lab_label
+    match = pins_match(outputs=config["segment_pins"] + config["digit_pins"])
+    if should_load(requested, match, auto_detect):
+        from devices.seven_segment import SevenSegmentDisplay
+        config["raw_log"] = os.environ.get("MOCK_7SEG_RAW", "0") == "1"
+        device = SevenSegmentDisplay(**config)
         active_devices.append(device)
-        print(f"[MockRunner] Loaded HC-SR04 (dist={dist}cm)")
+        print(f"[MockRunner] Loaded 7-Segment display (raw_log={config['raw_log']})")
 
     elif lab_label == 'led':
         pass
 
+    # 讓設備可以輸出自己的事件、讀取板子狀態，並登記不需記錄原始輸出的腳位
+    for device in active_devices:
+        device.log_event = log_action
+        device.board = board
+        muted_pins.update(device.muted_pins)
+
 # === GPIO Hook 函式 (核心轉發邏輯) ===
-def log_action(action, pin=None, value=None):
-    check_timeout()  # 每次動作前檢查是否超時
-    now = time.time() - start_time
-    logs.append({
+def log_action(action, pin=None, value=None, at=None):
+    # at: 事件發生的絕對時間 (設備事件用)，預設為現在
+    # 設備事件可能在模擬結束時才輸出，因此不做超時檢查
+    if at is None:
+        check_timeout()  # 每次動作前檢查是否超時
+        at = time.time()
+    now = at - start_time
+    if vcd_writer is not None:
+        vcd_writer.record(action, pin, value, now)
+    thread_buffer().append((now, {
         "time": round(now, 3),
         "action": action,
         "pin": pin,
         "value": value
-    })
+    }))
     if pin is not None:
         used_pins.add(pin)
 
@@ -66,8 +419,15 @@ orig_output = GPIO.output
 def logged_output(pin, value):
     now = time.time()
     
-    # 寫入 Log
-    log_action("GPIO.output", pin, value)
+    # 寫入 Log (已由設備解碼的腳位只記錄使用狀態)
+    if pin in muted_pins:
+        check_timeout()
+        used_pins.add(pin)
+        if vcd_writer is not None:
+            vcd_writer.record("GPIO.output", pin, value, now - start_time)
+    else:
+        log_action("GPIO.output", pin, value)
+    board.set_level(pin, value)
     
     # 通知所有設備 (例如觸發超音波 TRIG)
     for device in active_devices:
@@ -82,14 +442,28 @@ def simulated_input(pin):
     used_pins.add(pin)
     now = time.time()
     
-    # 問問看有沒有設備要負責這個腳位的 Input (例如超音波 ECHO)
-    for device in active_devices:
-        result = device.handle_input(pin, now)
-        if result is not None:
-            return result
-            
-    # 沒有人認領，就回傳 Mock.GPIO 的預設值
-    return orig_input(pin)
+    if trace_replayer is not None:
+        # 重播：直接使用錄製時的回傳值 (已包含設備當時的狀態)
+        result = trace_replayer.input()
+    else:
+        # 問問看有沒有設備要負責這個腳位的 Input (例如超音波 ECHO)
+        for device in active_devices:
+            result = device.handle_input(pin, now)
+            if result is not None:
+                break
+        else:
+            # 沒有人認領，就回傳 Mock.GPIO 的預設值
+            result = orig_input(pin)
+        if trace_recorder is not None:
+            trace_recorder.input(result)
+    if result is not None:
+        for p in board_pins(pin):
+            board.set_level(p, result)
+
+    # 波形檔只記錄輸入值的變化 (例如 ECHO 脈衝)
+    if vcd_writer is not None:
+        vcd_writer.record("GPIO.input", pin, result, now - start_time)
+    return result
 GPIO.input = simulated_input
 
 orig_setup = GPIO.setup
@@ -107,6 +481,8 @@ def logged_setup(pin, mode, pull_up_down=None, initial=None):
         kwargs['pull_up_down'] = pull_up_down
     if initial is not None:
         kwargs['initial'] = initial
+    for p in board_pins(pin):
+        board.setup(p, mode, pull_up_down, initial)
         
     orig_setup(pin, mode, **kwargs)
 GPIO.setup = logged_setup
@@ -118,63 +494,355 @@ class LoggedPWM(GPIO.PWM):
         check_timeout() # [NEW]
         super().__init__(pin, freq)
         self.pin = pin
+        self.running = False
         log_action("PWM.init", pin, freq)
+        board.set_pwm(pin, frequency=freq)
     def ChangeDutyCycle(self, duty):
         log_action("PWM.ChangeDutyCycle", self.pin, duty)
+        if self.running:
+            board.set_pwm(self.pin, duty=duty)
         super().ChangeDutyCycle(duty)
     def ChangeFrequency(self, frequency):
         log_action("PWM.ChangeFrequency", self.pin, frequency)
+        board.set_pwm(self.pin, frequency=frequency)
         super().ChangeFrequency(frequency)
     def start(self, duty):
         log_action("PWM.start", self.pin, duty)
+        self.running = True
+        board.set_pwm(self.pin, duty=duty)
         super().start(duty)
     def stop(self):
         log_action("PWM.stop", self.pin)
+        self.running = False
+        board.set_pwm(self.pin, duty=-1.0)
         super().stop()
 GPIO.PWM = LoggedPWM
 
+# === 取樣式效能分析 (--profile) ===
+class SamplingProfiler:
+    """
+    依 CPU 時間取樣所有執行緒的 call stack，開銷低且不需修改使用者程式：
+    以 setitimer(ITIMER_PROF) 每使用 interval 秒的 CPU 就在主執行緒觸發一次 SIGPROF，
+    因此短暫的 CPU 工作也會被取樣 (背景執行緒取樣只能在主執行緒釋放 GIL 時執行，會偏向睡眠)。
+    睡眠時間不靠取樣，而是在 hb_sleep 中直接量測。
+    CPU 樣本依 stack 內容分類：
+        runner - 正在執行 Runner 的 Hook、虛擬設備或 Mock.GPIO (例如忙碌輪詢 GPIO.input)
+        user   - 使用者程式本身的邏輯
+        other  - 其他 (例如模組載入)
+    沒有 setitimer 的平台 (Windows) 改用背景執行緒定期取樣。
+    """
+
+    def __init__(self, target_file, interval=0.005):
+        self.target_file = os.path.abspath(target_file)
+        self.runner_files = (os.path.abspath(__file__), os.path.abspath(GPIO.__file__))
+        self.devices_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "devices")
+        self.threading_file = os.path.abspath(threading.__file__)
+        self.interval = interval
+        self.stacks = {}        # collapsed stack -> 樣本數
+        self.self_counts = {}   # 函式 -> 自身樣本數
+        self.total_counts = {}  # 函式 -> 包含呼叫的樣本數
+        self.categories = {"user": 0, "runner": 0, "other": 0}
+        self.threads = {}       # 執行緒名稱 -> CPU 樣本數
+        self.samples = 0
+        self.sleep_seconds = 0.0
+        self.sleep_calls = 0
+        self.sleep_lock = threading.Lock()
+        self.elapsed = 0.0
+        self.cpu_seconds = 0.0
+        self.paths = {}         # co_filename -> 絕對路徑 (快取)
+        self.main_ident = threading.main_thread().ident
+        self.use_signal = hasattr(signal, "setitimer")
+        self.previous_handler = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _path(self, filename):
+        path = self.paths.get(filename)
+        if path is None:
+            path = self.paths[filename] = os.path.abspath(filename)
+        return path
+
+    def _is_runner(self, filename):
+        filename = self._path(filename)
+        return filename in self.runner_files or filename.startswith(self.devices_dir)
+
+    def record_sleep(self, seconds):
+        """由 hb_sleep 呼叫：累計實際睡眠的時間"""
+        with self.sleep_lock:
+            self.sleep_seconds += seconds
+            self.sleep_calls += 1
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _is_idle(self, stack):
+        # 正在睡眠，或停在 threading 的等待 (join / Event.wait / Lock) 的執行緒沒有使用 CPU
+        return (any(code is hb_sleep.__code__ for code in stack)
+                or self._path(stack[-1].co_filename) == self.threading_file)
+
+    def _sample(self, thread_name, stack):
+        # 只保留使用者程式 (含) 以下的 frame，去掉 Runner 載入模組與 threading 啟動的部分
+        for i, code in enumerate(stack):
+            if self._path(code.co_filename) == self.target_file:
+                stack = stack[i:]
+                break
+
+        names = [f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+                 for code in stack]
+        if self._is_runner(stack[-1].co_filename):
+            category = "runner"
+        elif self._path(stack[0].co_filename) == self.target_file:
+            category = "user"
+        else:
+            category = "other"
+
+        self.samples += 1
+        self.categories[category] += 1
+        self.threads[thread_name] = self.threads.get(thread_name, 0) + 1
+        key = ";".join([thread_name] + names)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.self_counts[names[-1]] = self.self_counts.get(names[-1], 0) + 1
+        for name in set(names):
+            self.total_counts[name] = self.total_counts.get(name, 0) + 1
+
+    def _take_samples(self, frames):
+        """frames: {執行緒 ident: 目前的 frame}；只記錄正在使用 CPU 的執行緒"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in frames.items():
+            stack = self._stack(frame)
+            if stack and not self._is_idle(stack):
+                self._sample(names.get(ident, str(ident)), stack)
+
+    def _on_signal(self, signum, frame):
+        # 訊號處理函式在主執行緒執行，frame 是主執行緒被中斷的位置
+        frames = sys._current_frames()
+        frames[self.main_ident] = frame
+        self._take_samples(frames)
+
+    def _run(self):
+        # 使用 Event.wait 計時，避免呼叫到被攔截的 time.sleep
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            frames.pop(own, None)
+            self._take_samples(frames)
+
+    def start(self):
+        self.elapsed = original_time_funcs["perf_counter"]()
+        self.cpu_seconds = time.process_time()
+        if self.use_signal:
+            self.previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self.thread = threading.Thread(target=self._run, name="MockRunnerProfiler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.use_signal:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+        else:
+            self.stop_event.set()
+            if self.thread is not None:
+                self.thread.join()
+        self.elapsed = original_time_funcs["perf_counter"]() - self.elapsed
+        self.cpu_seconds = time.process_time() - self.cpu_seconds
+
+    def report(self, top=15):
+        # CPU 時間依樣本比例分配；百分比以實際經過時間 (wall time) 為分母
+        def percent(seconds):
+            return round(100.0 * seconds / self.elapsed, 1) if self.elapsed else 0.0
+
+        def share(count):
+            seconds = self.cpu_seconds * count / self.samples if self.samples else 0.0
+            return {"samples": count, "seconds": round(seconds, 3), "percent": percent(seconds)}
+
+        breakdown = {name: share(count) for name, count in self.categories.items()}
+        breakdown["sleep"] = {
+            "calls": self.sleep_calls,
+            "seconds": round(self.sleep_seconds, 3),
+            "percent": percent(self.sleep_seconds),
+        }
+        top_functions = sorted(self.self_counts.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "interval": self.interval,
+            "samples": self.samples,
+            "elapsed": round(self.elapsed, 3),
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "breakdown": breakdown,
+            "threads": {name: share(count) for name, count in self.threads.items()},
+            "top_functions": [
+                {"function": name, "self": share(count), "total": share(self.total_counts[name])}
+                for name, count in top_functions
+            ],
+            # flamegraph.pl / speedscope 可直接讀取的 collapsed stack 格式 (第一層為執行緒名稱)
+            "collapsed": [f"{key} {count}" for key, count in
+                          sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)],
+        }
+
 # === 主程式執行 ===
 if __name__ == "__main__":
+    # 批次模式：python mock_runner.py batch <dir> [...]，交給 batch_runner 平行執行整個資料夾
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from batch_runner import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser()
-    parser.add_argument("script", help="User script to run")
+    parser.add_argument("script", nargs="?", help="User script to run (omit with --replay)")
     # 接收 lab 參數，用來決定要載入哪些設備
     parser.add_argument("--lab", default="unknown", help="Lab label (e.g., led, hc-sr04)")
     # 接收 duration 參數
     parser.add_argument("--duration", type=float, default=None, help="Max simulation duration")
+    # 效能分析：取樣使用者程式的 call stack
+    parser.add_argument("--profile", action="store_true", help="Sample where the script spends its time")
+    parser.add_argument("--profile-interval", type=float, default=0.005, help="Profiler sampling interval (s)")
+    # 波形輸出：邊執行邊寫出 VCD 檔 (可用 GTKWave 開啟)
+    parser.add_argument("--vcd", default=None, help="Write a VCD waveform file to this path")
+    # 錄製 / 重播：記錄所有不確定的輸入，之後可不必真的等待就重新產生完全相同的事件
+    parser.add_argument("--record-trace", default=None, help="Record a replay trace to this path")
+    parser.add_argument("--replay", default=None, help="Replay a recorded trace instead of running live")
     args = parser.parse_args()
+    if not args.script and not args.replay:
+        parser.error("a script is required unless --replay is given")
+
+    # 載入並執行使用者程式
+    target_file = args.script
+    source = None
+    if args.replay:
+        from trace_replay import TraceReplayer
+        trace_replayer = TraceReplayer.load(args.replay)
+        trace = trace_replayer.trace
+        # 以錄製時的程式碼、設備設定與時間基準重播
+        target_file = trace["program"]
+        source = trace["source"]
+        args.lab = trace["lab"]
+        args.duration = trace["duration"]
+        os.environ.update(trace.get("env", {}))
+        start_time = trace_replayer.start_time
+        print(f"[MockRunner] Replaying trace {args.replay}")
+    elif args.record_trace:
+        from trace_replay import TraceRecorder
+        trace_recorder = TraceRecorder(start_time, clock_bases())
 
     # 設定全域超時時間
     MAX_DURATION = args.duration
 
-    # 初始化設備
+    # 靜態分析使用者程式，並依此初始化設備 (重播時使用錄製當時的分析結果，確保載入相同的設備)
+    if trace_replayer is not None and "analysis" in trace_replayer.trace:
+        script_analysis = trace_replayer.trace["analysis"]
+    else:
+        script_analysis = load_script_analysis(target_file, source)
+    if script_analysis and script_analysis.get("max_pin") is not None:
+        board.reserve(script_analysis["max_pin"])
     setup_devices(args.lab)
+    if args.vcd:
+        from vcd_writer import VcdWriter
+        vcd_writer = VcdWriter(args.vcd)
 
-    # 載入並執行使用者程式
-    target_file = args.script
+    # 結束原因：completed / timeout / exit (使用者 sys.exit) / interrupted / error
+    exit_reason = "completed"
+    script_error = None
+    if args.profile and trace_replayer is None:
+        profiler = SamplingProfiler(target_file, interval=args.profile_interval)
+        profiler.start()
     
+    if trace_recorder is not None or trace_replayer is not None:
+        install_trace_hooks()
+
     try:
-        spec = importlib.util.spec_from_file_location("target", target_file)
-        target = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(target)
-    except SystemExit:
+        if source is not None:
+            target = type(sys)("target")
+            target.__file__ = target_file
+            exec(compile(source, target_file, "exec"), target.__dict__)
+        else:
+            spec = importlib.util.spec_from_file_location("target", target_file)
+            target = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(target)
+    except SystemExit as e:
         # 捕捉我們自己拋出的超時 (check_timeout)，或是使用者 sys.exit()
         # 這算是正常結束的一種，讓我們能夠進入 finally 寫 log
+        exit_reason = "timeout" if str(e) == "Simulation Timeout" else "exit"
+        if str(e) == "Replay trace exhausted":
+            # 重播時的執行路徑與錄製時不同 (例如程式碼或設備設定被改過)
+            exit_reason = "replay_diverged"
         print(f"[MockRunner] Stopped (Reason: SystemExit/Timeout)")
+    except KeyboardInterrupt:
+        # Server 強制中斷 (SIGINT)：記錄原因後照常寫 log
+        exit_reason = "interrupted"
+        raise
     except Exception as e:
         # 捕捉使用者程式的錯誤，避免 Runner 崩潰
         # 這裡印出錯誤讓 Server stderr 捕捉
+        exit_reason = "error"
+        script_error = f"{type(e).__name__}: {e}"
         print(f"[MockRunner] Script Error: {e}")
     finally:
+        if profiler is not None:
+            profiler.stop()
+
+        # 結束時間也經過錄製/重播，設備以此輸出的最後事件 (例如七段顯示器最後一幀) 才會相同
+        try:
+            end_time = time.time()
+        except SystemExit:
+            end_time = trace_replayer.last_time
+        if trace_replayer is not None:
+            # 重播不需等待：讓背景執行緒把自己的 trace 播完 (讀完即結束) 再合併事件
+            for thread in threading.enumerate():
+                if thread is not threading.current_thread():
+                    thread.join(timeout=5)
+        if trace_recorder is not None or trace_replayer is not None:
+            remove_trace_hooks()
+        if trace_recorder is not None:
+            with open(target_file, "r", encoding="utf-8") as f:
+                trace_source = f.read()
+            trace_recorder.save(
+                args.record_trace,
+                program=target_file,
+                source=trace_source,
+                lab=args.lab,
+                duration=args.duration,
+                analysis=script_analysis,
+                env={k: v for k, v in os.environ.items()
+                     if k.startswith("MOCK_") and k != "MOCK_SCRIPT_ANALYSIS"},
+            )
+
+        # 通知設備模擬結束，輸出尚未結束的事件 (例如七段顯示器最後一幀)
+        for device in active_devices:
+            device.handle_finish(end_time)
+        # 合併各執行緒的事件；設備事件以開始時間記錄，也會在這裡排回正確位置
+        threads = flush_logs()
+        if vcd_writer is not None:
+            vcd_writer.close()
+
         # 模擬結束，輸出 JSON
         output_file = "mock_log.json"
         result = {
             "program": target_file,
             "lab": args.lab,
             "start_time": start_time,
-            "duration": round(time.time() - start_time, 3),
+            "duration": round(end_time - start_time, 3),
+            "exit_reason": exit_reason,
+            "error": script_error,
             "used_pins": sorted(list(used_pins)),
+            # 模擬結束時每個腳位的狀態，不需從 Log 重建
+            "board_state": board.snapshot().as_dict(),
+            "analysis": script_analysis,
+            "vcd_file": args.vcd,
+            "trace_file": args.record_trace,
+            "replayed": trace_replayer is not None,
             "logs": logs
         }
+        if len(threads) > 1:
+            result["threads"] = threads
+        if profiler is not None:
+            result["profile"] = profiler.report()
+            with open("mock_profile.folded", "w", encoding="utf-8") as f:
+                f.write("\n".join(result["profile"]["collapsed"]) + "\n")
         
         try:
             with open(output_file, "w", encoding="utf-8") as f:
@@ -0,0 +1,107 @@
+import time
+import uuid
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+class RunStore:
+    """
+    在伺服器記憶體中保存已完成的模擬結果，讓前端可以分頁讀取 Log。
+    保留策略：最多保存 max_runs 筆、合計最多 max_events 筆 Log 與 max_file_bytes 的附帶檔案，
+    且超過 ttl 秒的結果會被清除 (先進先出)。單筆就超過上限的結果不會被保存。
+    """
+
+    def __init__(self, max_runs=50, ttl=3600, max_events=500000, max_file_bytes=64 * 1024 * 1024):
+        self.max_runs = max_runs
+        self.ttl = ttl
+        self.max_events = max_events
+        self.max_file_bytes = max_file_bytes
+        self.runs = OrderedDict()
+        self.total_events = 0
+        self.total_file_bytes = 0
+        self.lock = threading.Lock()
+
+    def _over_budget(self):
+        return (len(self.runs) > self.max_runs or self.total_events > self.max_events
+                or self.total_file_bytes > self.max_file_bytes)
+
+    def _remove(self, run_id):
+        run = self.runs.pop(run_id)
+        self.total_events -= len(run["logs"])
+        self.total_file_bytes -= run["file_bytes"]
+
+    def _evict(self, now):
+        # OrderedDict 依建立順序排列，從最舊的開始清除
+        while self.runs:
+            run_id, run = next(iter(self.runs.items()))
+            if self._over_budget() or now - run["created"] > self.ttl:
+                self._remove(run_id)
+            else:
+                break
+
+    def put(self, result, files=None):
+        """
+        保存一次模擬結果並回傳 run_id；result 中的 logs 會被拆出另外保存
+        :param files: 附帶的檔案內容 (例如 {"vcd": bytes})，供之後下載
+        :return: run_id；單筆就超過保存上限時回傳 None
+        """
+        logs = result.get("logs", [])
+        files = files or {}
+        file_bytes = sum(len(content) for content in files.values())
+        if len(logs) > self.max_events or file_bytes > self.max_file_bytes:
+            return None
+        summary = {k: v for k, v in result.items() if k != "logs"}
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        run = {
+            "created": now,
+            "summary": summary,
+            "logs": logs,
+            # Runner 輸出的 Log 已依時間排序，預先取出時間欄位供 bisect 查詢
+            "times": [log["time"] for log in logs],
+            "files": files,
+            "file_bytes": file_bytes,
+        }
+        with self.lock:
+            self.runs[run_id] = run
+            self.total_events += len(logs)
+            self.total_file_bytes += file_bytes
+            self._evict(now)
+        return run_id
+
+    def get(self, run_id):
+        with self.lock:
+            self._evict(time.time())
+            return self.runs.get(run_id)
+
+    def delete(self, run_id):
+        with self.lock:
+            if run_id not in self.runs:
+                return False
+            self._remove(run_id)
+            return True
+
+    def query_logs(self, run, cursor=0, limit=1000, start=None, end=None, pins=None, actions=None):
+        """
+        以 cursor 分頁讀取 Log。
+        :param cursor: 從第幾筆 (原始 Log 索引) 開始掃描
+        :param start, end: 時間範圍 (秒，含兩端)
+        :param pins, actions: 只回傳指定腳位/動作的 Log (set)
+        :return: (logs, next_cursor)；next_cursor 為 None 代表已到結尾
+        """
+        logs, times = run["logs"], run["times"]
+        lo = max(cursor, bisect_left(times, start) if start is not None else 0)
+        hi = bisect_right(times, end) if end is not None else len(logs)
+
+        page = []
+        i = lo
+        while i < hi and len(page) < limit:
+            log = logs[i]
+            i += 1
+            if pins is not None and log["pin"] not in pins:
+                continue
+            if actions is not None and log["action"] not in actions:
+                continue
+            page.append(log)
+        return page, (i if i < hi else None)
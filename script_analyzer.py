@@ -0,0 +1,425 @@
+import ast
+import builtins
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+
+# 視為「睡眠」的呼叫 (time.sleep / sleep)
+SLEEP_NAMES = {"sleep"}
+# 會讓程式結束的呼叫
+EXIT_NAMES = {"exit", "quit", "_exit"}
+# 在無窮迴圈中可以確定不會阻塞或結束程式的呼叫
+SAFE_BUILTINS = {
+    "print", "range", "len", "int", "float", "str", "bool", "round", "abs", "min", "max",
+    "sum", "list", "tuple", "dict", "set", "enumerate", "zip", "sorted", "format",
+}
+SAFE_TIME_FUNCS = {"time", "monotonic", "perf_counter", "localtime", "strftime"}
+PWM_METHODS = {"start", "stop", "ChangeDutyCycle", "ChangeFrequency"}
+# 無窮迴圈中可確定不會 (隱含地) 拋出例外的語法；下標、除法、assert、屬性存取等都可能拋出例外而離開迴圈
+SAFE_LOOP_NODES = (
+    ast.Expr, ast.Assign, ast.AugAssign, ast.Pass, ast.If, ast.While, ast.Continue, ast.Break,
+    ast.Return, ast.Global, ast.Nonlocal, ast.Constant, ast.Name, ast.Compare, ast.BoolOp,
+    ast.UnaryOp, ast.BinOp, ast.IfExp, ast.JoinedStr, ast.FormattedValue, ast.List, ast.Tuple,
+    ast.Call, ast.keyword, ast.expr_context, ast.operator, ast.cmpop, ast.boolop, ast.unaryop,
+)
+SAFE_LOOP_OPS = (ast.Add, ast.Sub, ast.Mult, ast.BitAnd, ast.BitOr, ast.BitXor)
+
+# 相同程式碼的分析結果快取 (以 sha256 為 key)
+CACHE_SIZE = 256
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _is_constant_true(node):
+    return isinstance(node, ast.Constant) and bool(node.value)
+
+
+def _call_name(func):
+    """回傳呼叫的 (物件名稱, 函式名稱)，例如 GPIO.output -> ('GPIO', 'output')"""
+    if isinstance(func, ast.Name):
+        return None, func.id
+    if isinstance(func, ast.Attribute):
+        owner = func.value.id if isinstance(func.value, ast.Name) else None
+        return owner, func.attr
+    return None, None
+
+
+def _bindings(tree):
+    """
+    回傳 (模組層級名稱的賦值次數, 程式中所有綁定過的名稱)。
+    函式中以 global 宣告後的賦值也算在模組層級。
+    """
+    counts = Counter()
+    bound = set(dir(builtins))
+
+    def count_module(node):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            return
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            counts[node.id] += 1
+        for child in ast.iter_child_nodes(node):
+            count_module(child)
+
+    for stmt in tree.body:
+        count_module(stmt)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.alias):
+            bound.add((node.asname or node.name).split(".")[0])
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            declared = {name for stmt in ast.walk(node) if isinstance(stmt, ast.Global) for name in stmt.names}
+            for child in ast.walk(node):
+                if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store) and child.id in declared:
+                    counts[child.id] += 1
+    return counts, bound
+
+
+class _FunctionScope(dict):
+    """
+    函式 (或 lambda) 的區域名稱：參數與區域變數先以 None (無法解析) 遮蔽同名的模組常數，
+    只賦值一次的區域常數會在走訪到賦值時填入。global / nonlocal 宣告的名稱不在此範圍。
+    """
+
+    def __init__(self, node):
+        super().__init__()
+        self.counts = Counter()
+        declared = set()
+
+        def collect(child):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                self.counts[child.name] += 1  # 巢狀定義的名稱也是區域變數，但不進入其內容
+                return
+            if isinstance(child, ast.Lambda):
+                return
+            if isinstance(child, (ast.Global, ast.Nonlocal)):
+                declared.update(child.names)
+            elif isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                self.counts[child.id] += 1
+            for grandchild in ast.iter_child_nodes(child):
+                collect(grandchild)
+
+        for stmt in (node.body if isinstance(node.body, list) else [node.body]):
+            collect(stmt)
+        args = node.args
+        params = [arg.arg for arg in args.posonlyargs + args.args + args.kwonlyargs]
+        params += [arg.arg for arg in (args.vararg, args.kwarg) if arg is not None]
+        for name in params:
+            self.counts[name] += 2  # 參數的值由呼叫者決定，永遠無法解析
+        for name in self.counts:
+            if name not in declared:
+                self[name] = None
+
+
+class _ScriptVisitor(ast.NodeVisitor):
+    """走訪使用者程式的 AST，收集 GPIO 模式、腳位與迴圈資訊"""
+
+    def __init__(self, bindings=None, bound_names=None):
+        self.gpio_aliases = {"GPIO"}
+        self.time_aliases = {"time"}
+        self.env = {}          # 模組層級常數：名稱 -> set(int)
+        self.bindings = bindings if bindings is not None else Counter()  # 模組層級名稱的賦值次數
+        self.bound_names = bound_names if bound_names is not None else set()
+        self.function_depth = 0  # 目前所在的函式/類別巢狀層數
+        self.scopes = []       # for 迴圈變數與函式區域名稱的暫時綁定 (None 代表無法解析)
+        self.functions = {}    # 函式名稱 -> FunctionDef
+        self.mode = None
+        self.pins = {"setup_out": set(), "setup_in": set(), "output": set(), "input": set(), "pwm": set()}
+        self.unresolved_pins = False
+        self.polling_loops = []
+
+    # --- 常數解析 ---
+    def _lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return self.env.get(name)
+
+    def resolve(self, node):
+        """盡可能把腳位參數解析成整數集合，無法解析時回傳 None"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, int) and not isinstance(node.value, bool):
+            return {node.value}
+        if isinstance(node, ast.Name):
+            return self._lookup(node.id)
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            values = set()
+            for elt in node.elts:
+                resolved = self.resolve(elt)
+                if resolved is None:
+                    return None
+                values |= resolved
+            return values
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            left, right = self.resolve(node.left), self.resolve(node.right)
+            if left is None or right is None:
+                return None
+            return left | right
+        if isinstance(node, ast.Subscript):
+            # segments[i] -> 視為 segments 內的任一元素
+            return self.resolve(node.value)
+        return None
+
+    def _record(self, kind, node):
+        resolved = self.resolve(node)
+        if resolved is None:
+            self.unresolved_pins = True
+        else:
+            self.pins[kind] |= resolved
+
+    # --- 走訪 ---
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.name == "RPi.GPIO":
+                self.gpio_aliases.add(alias.asname or "RPi")
+            elif alias.name == "time":
+                self.time_aliases.add(alias.asname or "time")
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        if node.module == "RPi":
+            for alias in node.names:
+                if alias.name == "GPIO":
+                    self.gpio_aliases.add(alias.asname or "GPIO")
+        self.generic_visit(node)
+
+    def _function_scope(self):
+        for scope in reversed(self.scopes):
+            if isinstance(scope, _FunctionScope):
+                return scope
+        return None
+
+    def visit_Assign(self, node):
+        # 只記錄只賦值一次的名稱 (模組層級或函式內的區域常數)；重複賦值的名稱視為無法解析
+        if len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            scope = self._function_scope()
+            if scope is None:
+                if not self.scopes and not self.function_depth and self.bindings[name] == 1:
+                    resolved = self.resolve(node.value)
+                    if resolved is not None:
+                        self.env[name] = resolved
+            elif name in scope and scope.counts[name] == 1:
+                scope[name] = self.resolve(node.value)
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        self.functions[node.name] = node
+        self.function_depth += 1
+        self.scopes.append(_FunctionScope(node))
+        self.generic_visit(node)
+        self.scopes.pop()
+        self.function_depth -= 1
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self.scopes.append(_FunctionScope(node))
+        self.generic_visit(node)
+        self.scopes.pop()
+
+    def visit_ClassDef(self, node):
+        self.function_depth += 1
+        self.generic_visit(node)
+        self.function_depth -= 1
+
+    def visit_For(self, node):
+        self.visit(node.iter)
+        scope = {}
+        if isinstance(node.target, ast.Name):
+            resolved = self.resolve(node.iter)
+            if resolved is not None:
+                scope[node.target.id] = resolved
+        self.scopes.append(scope)
+        for stmt in node.body + node.orelse:
+            self.visit(stmt)
+        self.scopes.pop()
+
+    def visit_While(self, node):
+        if any(self._is_gpio_call(n, "input") for n in ast.walk(node.test)):
+            self.polling_loops.append(node.lineno)
+        self.generic_visit(node)
+
+    def _is_gpio_call(self, node, name):
+        if not isinstance(node, ast.Call):
+            return False
+        owner, func = _call_name(node.func)
+        return owner in self.gpio_aliases and func == name
+
+    def visit_Call(self, node):
+        owner, func = _call_name(node.func)
+        if owner in self.gpio_aliases:
+            args = node.args
+            kwargs = {kw.arg: kw.value for kw in node.keywords}
+            if func == "setmode" and args and isinstance(args[0], ast.Attribute):
+                self.mode = args[0].attr
+            elif func == "setup" and (args or "channel" in kwargs):
+                direction = args[1] if len(args) > 1 else kwargs.get("direction")
+                is_input = isinstance(direction, ast.Attribute) and direction.attr == "IN"
+                self._record("setup_in" if is_input else "setup_out", args[0] if args else kwargs["channel"])
+            elif func == "output" and args:
+                self._record("output", args[0])
+            elif func == "input" and args:
+                self._record("input", args[0])
+            elif func == "PWM" and args:
+                self._record("pwm", args[0])
+        self.generic_visit(node)
+
+
+class _LoopChecker:
+    """判斷 while True 迴圈是否一定會執行到超時 (沒有睡眠、也沒有任何離開迴圈的方式)"""
+
+    def __init__(self, visitor):
+        self.visitor = visitor
+        self.memo = {}
+
+    def _call_is_safe(self, call, stack):
+        owner, func = _call_name(call.func)
+        if owner in self.visitor.gpio_aliases:
+            return True
+        if owner in self.visitor.time_aliases:
+            return func in SAFE_TIME_FUNCS
+        if owner is None and func in SAFE_BUILTINS:
+            return True
+        if owner is not None and func in PWM_METHODS:
+            return True
+        if owner is None and func in self.visitor.functions:
+            return self.function_is_busy(func, stack)
+        return False
+
+    def function_is_busy(self, name, stack=()):
+        """函式 (含其呼叫的函式) 中沒有睡眠、例外或結束程式的呼叫"""
+        if name in self.memo:
+            return self.memo[name]
+        if name in stack:
+            return False
+        body = self.visitor.functions[name].body
+        result = self._body_is_busy(body, stack + (name,), allow_return=True)
+        self.memo[name] = result
+        return result
+
+    def _body_is_busy(self, body, stack, allow_return):
+        """只有在每個語句都確定不會拋出例外、睡眠或結束程式時才回傳 True"""
+        for stmt in body:
+            # 只有被呼叫的函式本身 (例如 GPIO.output) 可以是屬性存取，呼叫是否安全另外判斷
+            call_funcs = {id(node.func) for node in ast.walk(stmt) if isinstance(node, ast.Call)}
+            for node in ast.walk(stmt):
+                if isinstance(node, ast.Attribute) and id(node) in call_funcs:
+                    if not isinstance(node.value, ast.Name) or node.value.id not in self.visitor.bound_names:
+                        return False
+                    continue
+                if not isinstance(node, SAFE_LOOP_NODES):
+                    return False
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) \
+                        and node.id not in self.visitor.bound_names:
+                    return False  # 可能是 NameError
+                if isinstance(node, ast.BinOp) and not isinstance(node.op, SAFE_LOOP_OPS):
+                    return False  # 例如除以零
+                if isinstance(node, ast.Return) and not allow_return:
+                    return False
+                if isinstance(node, ast.Call):
+                    _, func = _call_name(node.func)
+                    if func in SLEEP_NAMES or func in EXIT_NAMES:
+                        return False
+                    if not self._call_is_safe(node, stack):
+                        return False
+        return True
+
+    def loop_is_busy(self, loop):
+        if not _is_constant_true(loop.test):
+            return False
+        # 只要迴圈內有 break 就可能離開 (巢狀迴圈的 break 也保守地視為可離開)
+        if any(isinstance(node, ast.Break) for node in ast.walk(loop)):
+            return False
+        return self._body_is_busy(loop.body, (), allow_return=False)
+
+
+def _reachable_loops(tree, visitor):
+    """模組層級以及從模組層級 (直接或間接) 呼叫到的函式中的 while 迴圈"""
+    loops = []
+    seen = set()
+
+    def collect(body):
+        calls = []
+        for stmt in body:
+            for node in ast.walk(stmt):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    continue
+                if isinstance(node, ast.While):
+                    loops.append(node)
+                elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+                    calls.append(node.func.id)
+        for name in calls:
+            if name in visitor.functions and name not in seen:
+                seen.add(name)
+                collect(visitor.functions[name].body)
+
+    collect([stmt for stmt in tree.body if not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))])
+    return loops
+
+
+def analyze_source(source):
+    """
+    靜態分析使用者程式 (不執行)，回傳：
+        mode            - GPIO.setmode 的模式 (BCM / BOARD)
+        pins            - 依用途分類的腳位 (setup_out / setup_in / output / input / pwm)
+        all_pins, max_pin
+        unresolved_pins - 是否有無法靜態解析的腳位參數
+        polling_loops   - 以 GPIO.input 作為條件的 while 迴圈行號
+        busy_loops      - 沒有睡眠也無法離開的 while True 迴圈行號
+        certain_timeout - 是否一定會執行到超時且持續佔用 CPU
+        syntax_error    - 語法錯誤訊息 (若有)
+    """
+    result = {
+        "hash": hashlib.sha256(source.encode("utf-8")).hexdigest(),
+        "mode": None,
+        "pins": {},
+        "all_pins": [],
+        "max_pin": None,
+        "unresolved_pins": False,
+        "polling_loops": [],
+        "busy_loops": [],
+        "certain_timeout": False,
+        "syntax_error": None,
+    }
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        result["syntax_error"] = f"{e.msg} (line {e.lineno})"
+        return result
+
+    visitor = _ScriptVisitor(*_bindings(tree))
+    visitor.visit(tree)
+    checker = _LoopChecker(visitor)
+    busy_loops = sorted({loop.lineno for loop in _reachable_loops(tree, visitor) if checker.loop_is_busy(loop)})
+
+    all_pins = set().union(*visitor.pins.values())
+    result.update({
+        "mode": visitor.mode,
+        "pins": {kind: sorted(pins) for kind, pins in visitor.pins.items()},
+        "all_pins": sorted(all_pins),
+        "max_pin": max(all_pins) if all_pins else None,
+        "unresolved_pins": visitor.unresolved_pins,
+        "polling_loops": visitor.polling_loops,
+        "busy_loops": busy_loops,
+        "certain_timeout": bool(busy_loops),
+    })
+    return result
+
+
+def analyze_source_cached(source):
+    """與 analyze_source 相同，但以程式碼的 sha256 快取結果，重複送出的程式不必再解析"""
+    key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    result = analyze_source(source)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
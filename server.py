@@ -6,8 +6,18 @@ import subprocess
 import logging
 import signal
 import platform
-from flask import Flask, request, jsonify
+import gzip
+from flask import Flask, Response, request, jsonify
 from colorama import init, Fore, Back, Style
+from run_store import RunStore
+from script_analyzer import analyze_source_cached
+from log_compare import RunComparer
+from devices.distance_profile import build_profile
+
+try:
+    import brotli  # 選用：安裝後可支援 br 壓縮
+except ImportError:
+    brotli = None
 
 # Initialize colorama
 init(autoreset=True)
@@ -18,6 +28,17 @@ app = Flask(__name__)
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
+# === 已完成模擬的暫存 (供分頁讀取 Log) ===
+run_store = RunStore(
+    max_runs=int(os.environ.get("MAX_STORED_RUNS", 50)),
+    ttl=float(os.environ.get("RUN_TTL_SECONDS", 3600)),
+    max_events=int(os.environ.get("MAX_STORED_EVENTS", 500000)),
+    max_file_bytes=int(os.environ.get("MAX_STORED_FILE_BYTES", 64 * 1024 * 1024)),
+)
+
+# 小於此大小的回應不壓縮
+COMPRESS_MIN_SIZE = 1024
+
 # === Helper Functions for Colored Output ===
 def print_header(title):
     print(f"\n{Back.CYAN}{Fore.BLACK} {title} {Style.RESET_ALL}")
@@ -32,10 +53,93 @@ def print_footer(status, duration):
 def print_info(label, value):
     print(f"{Fore.YELLOW}{label:<15}: {Fore.WHITE}{value}{Style.RESET_ALL}")
 
+# === 回應壓縮 (依 Accept-Encoding 選擇 br / gzip) ===
+def accepted_encodings():
+    encodings = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        name, *params = part.strip().split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.status_code < 200
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype == 'application/json' or response.mimetype.startswith('text/'))):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    encodings = accepted_encodings()
+    if brotli is not None and 'br' in encodings:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in encodings:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+    response.vary.add('Accept-Encoding')
+    return response
+
 # === 路徑設定 ===
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MOCK_RUNNER_SRC = os.path.join(BASE_DIR, 'mock_runner.py')
 DEVICES_DIR_SRC = os.path.join(BASE_DIR, 'devices')  # devices 資料夾路徑
+VCD_WRITER_SRC = os.path.join(BASE_DIR, 'vcd_writer.py')  # Runner 輸出 VCD 時使用
+TRACE_REPLAY_SRC = os.path.join(BASE_DIR, 'trace_replay.py')  # Runner 錄製 / 重播 trace 時使用
+SCRIPT_ANALYZER_SRC = os.path.join(BASE_DIR, 'script_analyzer.py')  # 沒有傳入分析結果時由 Runner 自行分析
+# 重播不需真的等待，正常情況下很快就會結束
+REPLAY_TIMEOUT = 30
+# Runner 執行時 import 的選用模組 (只在對應功能啟用時使用)
+OPTIONAL_RUNNER_SRCS = (VCD_WRITER_SRC, TRACE_REPLAY_SRC, SCRIPT_ANALYZER_SRC)
+
+def prepare_runner_dir(temp_dir):
+    """
+    將 Runner 需要的檔案複製到暫存目錄。
+    mock_runner.py 與 devices/ 為必要檔案，缺少時回傳錯誤回應；選用模組存在才複製。
+    """
+    if not os.path.exists(MOCK_RUNNER_SRC):
+        print(f"{Fore.RED}Error: mock_runner.py not found{Style.RESET_ALL}")
+        return jsonify({"error": "mock_runner.py not found on server"}), 500
+    if not os.path.exists(DEVICES_DIR_SRC):
+        print(f"{Fore.RED}Error: devices/ directory not found{Style.RESET_ALL}")
+        return jsonify({"error": "devices/ directory not found on server"}), 500
+    shutil.copy(MOCK_RUNNER_SRC, os.path.join(temp_dir, 'mock_runner.py'))
+    for src in OPTIONAL_RUNNER_SRCS:
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(temp_dir, os.path.basename(src)))
+    shutil.copytree(DEVICES_DIR_SRC, os.path.join(temp_dir, 'devices'))
+    return None
+
+def reject_unrunnable(analysis, allow_busy_loop=False):
+    """依靜態分析擋掉必定失敗的程式：語法錯誤 400、一定空轉到超時 422；可以執行時回傳 None"""
+    if analysis['syntax_error']:
+        return jsonify({
+            "error": f"Syntax error: {analysis['syntax_error']}",
+            "status": "failed",
+            "analysis": analysis
+        }), 400
+    if analysis['certain_timeout'] and not allow_busy_loop:
+        return jsonify({
+            "error": "Script has an infinite loop without sleep and would run until timeout "
+                     f"(line {', '.join(map(str, analysis['busy_loops']))}). "
+                     "Add time.sleep() to the loop or set 'allow_busy_loop' to run it anyway.",
+            "status": "rejected",
+            "analysis": analysis
+        }), 422
+    return None
 
 @app.route('/api/simulate', methods=['POST'])
 def simulate():
@@ -54,34 +158,54 @@ def simulate():
     
     # 從前端接收距離設定，預設 50cm (給超音波使用)
     mock_distance = data.get('distance', 50)
+    # 選填：隨時間變化的距離設定 (keyframes / periodic / noise)，優先於 distance
+    distance_profile = data.get('distance_profile')
+    if distance_profile is not None:
+        if not isinstance(distance_profile, dict):
+            return jsonify({"error": "'distance_profile' must be an object"}), 400
+        # 先在伺服器建立一次，設定錯誤直接回傳 400，不必啟動 Runner
+        try:
+            build_profile(distance_profile)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid 'distance_profile': {e}"}), 400
+
+    # 是否在回應中直接附上完整 Log；設為 false 時只回傳 run_id，Log 改由 /api/runs/<run_id>/logs 分頁讀取
+    inline_logs = bool(data.get('inline_logs', True))
+
+    # === 靜態分析 (以程式碼 hash 快取)：在佔用執行資源前先擋掉必定失敗的程式 ===
+    analysis = analyze_source_cached(user_code)
+    rejection = reject_unrunnable(analysis, bool(data.get('allow_busy_loop', False)))
+    if rejection is not None:
+        return rejection
+
+    # 是否以取樣式 profiler 分析使用者程式的時間花在哪裡
+    profile = bool(data.get('profile', False))
+
+    # 是否同時輸出 VCD 波形檔，完成後可由 /api/runs/<run_id>/vcd 下載
+    want_vcd = bool(data.get('vcd', False))
+
+    # 是否錄製重播用的 trace，之後可由 /api/replay 不必等待地重新產生完全相同的 Log
+    record_trace = bool(data.get('record_trace', False))
+
+    # 七段顯示器是否保留原始段碼 Log (前端的 SevenSegment 元件需要原始 Log，預設保留)
+    raw_segments = bool(data.get('raw_segments', True))
 
     # === Print Simulation Start Info ===
     print_header("NEW SIMULATION REQUEST")
     print_info("Lab", lab_label)
     print_info("Duration", f"{duration}s")
     print_info("Distance", f"{mock_distance}cm")
+    if distance_profile:
+        print_info("Dist. Profile", distance_profile.get('type', 'constant'))
     print(f"{Fore.CYAN}{'-'*60}{Style.RESET_ALL}")
     print(f"{Fore.MAGENTA}>>> Output from mock_runner.py:{Style.RESET_ALL}")
 
     with tempfile.TemporaryDirectory() as temp_dir:
         try:
-            # === 準備檔案環境 ===
-            
-            # 複製 mock_runner.py
-            target_runner = os.path.join(temp_dir, 'mock_runner.py')
-            if os.path.exists(MOCK_RUNNER_SRC):
-                shutil.copy(MOCK_RUNNER_SRC, target_runner)
-            else:
-                print(f"{Fore.RED}Error: mock_runner.py not found{Style.RESET_ALL}")
-                return jsonify({"error": "mock_runner.py not found on server"}), 500
-
-            # 複製 devices 資料夾
-            target_devices_dir = os.path.join(temp_dir, 'devices')
-            if os.path.exists(DEVICES_DIR_SRC):
-                shutil.copytree(DEVICES_DIR_SRC, target_devices_dir)
-            else:
-                print(f"{Fore.RED}Error: devices/ directory not found{Style.RESET_ALL}")
-                return jsonify({"error": "devices/ directory not found on server"}), 500
+            # === 準備檔案環境 (mock_runner.py、選用模組與 devices 資料夾) ===
+            error_response = prepare_runner_dir(temp_dir)
+            if error_response is not None:
+                return error_response
 
             # 寫入使用者程式碼
             user_script_path = os.path.join(temp_dir, 'user_script.py')
@@ -99,10 +223,20 @@ def simulate():
                 '--lab', str(lab_label),
                 '--duration', str(duration)
             ]
+            if profile:
+                cmd.append('--profile')
+            if want_vcd:
+                cmd.extend(['--vcd', 'mock_wave.vcd'])
+            if record_trace:
+                cmd.extend(['--record-trace', 'mock_trace.json'])
             
             # === 設定環境變數 ===
             env = os.environ.copy()
             env["MOCK_DISTANCE"] = str(mock_distance)
+            if distance_profile:
+                env["MOCK_DISTANCE_PROFILE"] = json.dumps(distance_profile)
+            env["MOCK_7SEG_RAW"] = "1" if raw_segments else "0"
+            env["MOCK_SCRIPT_ANALYSIS"] = json.dumps(analysis)
 
             # === 執行模擬 ===
             process = subprocess.Popen(
@@ -155,7 +289,8 @@ def simulate():
                 result['input_settings'] = {
                     "lab": lab_label,
                     "duration": duration,
-                    "distance": mock_distance
+                    "distance": mock_distance,
+                    "distance_profile": distance_profile
                 }
                 
                 result['lab_label'] = lab_label
@@ -163,7 +298,22 @@ def simulate():
                 
                 if stderr:
                     result['server_stderr'] = stderr
+
+                result['log_count'] = len(result.get('logs', []))
+                files = {}
+                vcd_file = os.path.join(temp_dir, 'mock_wave.vcd')
+                if want_vcd and os.path.exists(vcd_file):
+                    with open(vcd_file, 'rb') as f:
+                        files['vcd'] = f.read()
+                trace_file = os.path.join(temp_dir, 'mock_trace.json')
+                if record_trace and os.path.exists(trace_file):
+                    with open(trace_file, 'rb') as f:
+                        files['trace'] = f.read()
+                result.pop('vcd_file', None)
+                result.pop('trace_file', None)
+                store_run(result, files, inline_logs)
                 
+                print_info("Run ID", result['run_id'])
                 print_footer("SUCCESS", duration)
                 return jsonify(result)
             else:
@@ -176,7 +326,8 @@ def simulate():
                     "input_settings": {
                         "lab": lab_label,
                         "duration": duration,
-                        "distance": mock_distance
+                        "distance": mock_distance,
+                        "distance_profile": distance_profile
                     }
                 }), 400
 
@@ -184,6 +335,235 @@ def simulate():
             print(f"{Fore.RED}Server Error: {e}{Style.RESET_ALL}")
             return jsonify({"error": str(e)}), 500
 
+# === 已完成模擬的查詢 ===
+def file_urls(run_id, files):
+    """執行結果附帶檔案 (VCD / trace) 的下載網址"""
+    return {f"{name}_url": f"/api/runs/{run_id}/{name}" for name in ('vcd', 'trace') if name in files}
+
+def store_run(result, files, inline_logs):
+    """
+    保存執行結果供分頁讀取與下載，並填入 run_id 與下載網址。
+    單筆就超過保存上限時不保存 (run_id 為 null)，此時一律在回應中附上完整 Log。
+    """
+    result['run_id'] = run_store.put(result, files=files)
+    if result['run_id'] is None:
+        result['stored'] = False
+        return
+    result.update(file_urls(result['run_id'], files))
+    if not inline_logs:
+        result.pop('logs', None)
+
+def parse_filter(value, cast):
+    if not value:
+        return None
+    return {cast(v.strip()) for v in value.split(',') if v.strip()}
+
+@app.route('/api/runs/<run_id>', methods=['GET'])
+def get_run(run_id):
+    run = run_store.get(run_id)
+    if run is None:
+        return jsonify({"error": "Run not found or expired"}), 404
+    summary = dict(run['summary'])
+    summary['log_count'] = len(run['logs'])
+    summary.update(file_urls(run_id, run['files']))
+    return jsonify(summary)
+
+@app.route('/api/runs/<run_id>', methods=['DELETE'])
+def delete_run(run_id):
+    if not run_store.delete(run_id):
+        return jsonify({"error": "Run not found or expired"}), 404
+    return jsonify({"run_id": run_id, "status": "deleted"})
+
+@app.route('/api/runs/<run_id>/vcd', methods=['GET'])
+def get_run_vcd(run_id):
+    run = run_store.get(run_id)
+    if run is None:
+        return jsonify({"error": "Run not found or expired"}), 404
+    vcd = run['files'].get('vcd')
+    if vcd is None:
+        return jsonify({"error": "No VCD recorded for this run (set 'vcd': true)"}), 404
+    return Response(vcd, mimetype='text/x-vcd', headers={
+        'Content-Disposition': f'attachment; filename="{run_id}.vcd"'
+    })
+
+@app.route('/api/runs/<run_id>/trace', methods=['GET'])
+def get_run_trace(run_id):
+    run = run_store.get(run_id)
+    if run is None:
+        return jsonify({"error": "Run not found or expired"}), 404
+    trace = run['files'].get('trace')
+    if trace is None:
+        return jsonify({"error": "No trace recorded for this run (set 'record_trace': true)"}), 404
+    return Response(trace, mimetype='application/json', headers={
+        'Content-Disposition': f'attachment; filename="{run_id}.trace.json"'
+    })
+
+@app.route('/api/runs/<run_id>/logs', methods=['GET'])
+def get_run_logs(run_id):
+    """
+    分頁讀取 Log，查詢參數：
+        cursor  - 上一頁回傳的 next_cursor (預設 0)
+        limit   - 每頁筆數 (預設 1000，最多 10000)
+        start / end - 時間範圍 (秒)
+        pin     - 腳位，逗號分隔 (例如 4,17)
+        action  - 動作，逗號分隔 (例如 GPIO.output,PWM.ChangeDutyCycle)
+    """
+    run = run_store.get(run_id)
+    if run is None:
+        return jsonify({"error": "Run not found or expired"}), 404
+
+    args = request.args
+    try:
+        cursor = max(0, int(args.get('cursor', 0)))
+        limit = min(max(1, int(args.get('limit', 1000))), 10000)
+        start = float(args['start']) if 'start' in args else None
+        end = float(args['end']) if 'end' in args else None
+        pins = parse_filter(args.get('pin'), int)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    actions = parse_filter(args.get('action'), str)
+
+    logs, next_cursor = run_store.query_logs(
+        run, cursor=cursor, limit=limit, start=start, end=end, pins=pins, actions=actions
+    )
+    return jsonify({
+        "run_id": run_id,
+        "logs": logs,
+        "next_cursor": next_cursor,
+        "total": len(run['logs']),
+    })
+
+# === 執行結果比對 (自動評分) ===
+def resolve_run(spec):
+    """比對對象可以是 run_id 字串，或直接傳入含 logs 的執行結果"""
+    if isinstance(spec, str):
+        run = run_store.get(spec)
+        if run is None:
+            raise LookupError(f"Run '{spec}' not found or expired")
+        return {"duration": run['summary'].get('duration'), "logs": run['logs']}
+    if isinstance(spec, dict) and isinstance(spec.get('logs'), list):
+        for i, log in enumerate(spec['logs']):
+            if not (isinstance(log, dict) and isinstance(log.get('time'), (int, float))
+                    and isinstance(log.get('action'), str) and 'pin' in log and 'value' in log):
+                raise ValueError(f"Log entry {i} must be an object with 'time', 'action', 'pin' and 'value'")
+        return spec
+    raise ValueError("Each run must be a run_id or an object with a 'logs' list")
+
+@app.route('/api/compare', methods=['POST'])
+def compare():
+    """
+    以參考執行結果比對一或多份執行結果：
+        {"reference": <run>, "candidate": <run>} 或 {"reference": <run>, "candidates": [<run>, ...]}
+    選填：time_tolerance (秒，預設 0.05)、value_tolerance (PWM，預設 1.0)、align_start (預設 true)
+    """
+    data = request.get_json()
+    if not data or 'reference' not in data or not ('candidate' in data or 'candidates' in data):
+        return jsonify({"error": "Missing 'reference' and 'candidate'/'candidates' fields"}), 400
+
+    try:
+        reference = resolve_run(data['reference'])
+        specs = data['candidates'] if 'candidates' in data else [data['candidate']]
+        if not isinstance(specs, list):
+            raise ValueError("'candidates' must be a list")
+        candidates = [resolve_run(spec) for spec in specs]
+        comparer = RunComparer(
+            reference,
+            time_tolerance=float(data.get('time_tolerance', 0.05)),
+            value_tolerance=float(data.get('value_tolerance', 1.0)),
+            align_start=bool(data.get('align_start', True)),
+        )
+    except KeyError as e:
+        # KeyError 也是 LookupError，但這是參考結果的 Log 格式錯誤，而不是找不到 run
+        return jsonify({"error": f"Malformed log entry: {e!r}"}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        reports = [comparer.compare(candidate) for candidate in candidates]
+    except (KeyError, TypeError, ValueError) as e:
+        # 例如 Display.frame 的 value 不是 {"text": ...}
+        return jsonify({"error": f"Malformed log entry: {e!r}"}), 400
+    if 'candidates' in data:
+        return jsonify({"results": reports})
+    return jsonify(reports[0])
+
+# === 重播 (不必等待地重新產生一次錄製過的模擬) ===
+@app.route('/api/replay', methods=['POST'])
+def replay():
+    """
+    依錄製的 trace 重新產生完整 Log，結果會另存為新的 run：
+        {"run_id": <以 record_trace 執行過的 run>} 或 {"trace": <trace 內容>}
+    選填：vcd (預設 false)、inline_logs (預設 true)、allow_busy_loop (僅對直接傳入的 trace，預設 false)
+    """
+    data = request.get_json()
+    if not data or not ('run_id' in data or 'trace' in data):
+        return jsonify({"error": "Missing 'run_id' or 'trace' field"}), 400
+
+    if 'run_id' in data:
+        run = run_store.get(data['run_id'])
+        if run is None:
+            return jsonify({"error": "Run not found or expired"}), 404
+        trace = run['files'].get('trace')
+        if trace is None:
+            return jsonify({"error": "No trace recorded for this run (set 'record_trace': true)"}), 404
+        wait_time = REPLAY_TIMEOUT
+    else:
+        # 直接傳入的 trace 內容由使用者控制，套用與 /api/simulate 相同的限制
+        trace = data['trace']
+        if not isinstance(trace, dict) or not isinstance(trace.get('source'), str):
+            return jsonify({"error": "'trace' must be an object with a 'source' string"}), 400
+        analysis = analyze_source_cached(trace['source'])
+        rejection = reject_unrunnable(analysis, bool(data.get('allow_busy_loop', False)))
+        if rejection is not None:
+            return rejection
+        try:
+            duration = min(float(trace.get('duration') or 10.0), 10.0)
+        except (TypeError, ValueError):
+            return jsonify({"error": "'trace.duration' must be a number"}), 400
+        trace = json.dumps(dict(trace, duration=duration, analysis=analysis)).encode('utf-8')
+        # 重播不會比原本的執行時間更久
+        wait_time = min(duration + 2.0, REPLAY_TIMEOUT)
+    want_vcd = bool(data.get('vcd', False))
+    inline_logs = bool(data.get('inline_logs', True))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        error_response = prepare_runner_dir(temp_dir)
+        if error_response is not None:
+            return error_response
+        with open(os.path.join(temp_dir, 'mock_trace.json'), 'wb') as f:
+            f.write(trace)
+
+        cmd = [sys.executable, 'mock_runner.py', '--replay', 'mock_trace.json']
+        if want_vcd:
+            cmd.extend(['--vcd', 'mock_wave.vcd'])
+        try:
+            completed = subprocess.run(cmd, cwd=temp_dir, capture_output=True, text=True,
+                                       timeout=wait_time)
+        except subprocess.TimeoutExpired:
+            return jsonify({"error": "Replay did not finish", "status": "failed"}), 500
+
+        log_file = os.path.join(temp_dir, 'mock_log.json')
+        if not os.path.exists(log_file):
+            return jsonify({"error": "No log generated.", "details": completed.stderr, "status": "failed"}), 400
+        with open(log_file, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+        files = {'trace': trace}
+        vcd_file = os.path.join(temp_dir, 'mock_wave.vcd')
+        if want_vcd and os.path.exists(vcd_file):
+            with open(vcd_file, 'rb') as f:
+                files['vcd'] = f.read()
+
+    result.pop('vcd_file', None)
+    result.pop('trace_file', None)
+    result['status'] = 'completed'
+    result['log_count'] = len(result.get('logs', []))
+    if 'run_id' in data:
+        result['replay_of'] = data['run_id']
+    store_run(result, files, inline_logs)
+    return jsonify(result)
+
 if __name__ == '__main__':
     print_header("SERVER STARTED")
     print_info("Host", "0.0.0.0")
@@ -0,0 +1,107 @@
+import json
+import threading
+
+TRACE_VERSION = 2
+# 時鐘讀值以相對於模擬開始時間的秒數保存，精度 0.1µs
+CLOCK_DIGITS = 7
+
+
+class TraceRecorder:
+    """
+    記錄一次模擬中所有不確定 (nondeterministic) 的輸入：
+        clock - 每次時鐘的讀值 (time.time / monotonic / perf_counter，包含 Runner 自己的計時)
+        input - 每次 GPIO.input() 回傳的值 (包含虛擬設備產生的值)，以 run-length 編碼保存
+    每個執行緒 (依名稱) 各自一條串流，重播時各執行緒讀回自己的值。
+    各種時鐘都以「模擬開始後經過的秒數」保存，重播時再加回各自的基準值。
+    """
+
+    def __init__(self, start_time, clock_bases):
+        """:param clock_bases: 各時鐘在模擬開始時的值，例如 {"time": start_time, "monotonic": ...}"""
+        self.start_time = start_time
+        self.clock_bases = dict(clock_bases)
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def _stream(self):
+        name = threading.current_thread().name
+        stream = self.streams.get(name)
+        if stream is None:
+            with self.lock:
+                stream = self.streams.setdefault(name, {"clock": [], "input": []})
+        return stream
+
+    def clock(self, value, kind="time"):
+        self._stream()["clock"].append(round(value - self.clock_bases[kind], CLOCK_DIGITS))
+
+    def input(self, value):
+        runs = self._stream()["input"]
+        # 忙碌輪詢時大量重複的值只記錄為 [值, 次數]
+        if runs and runs[-1][0] == value:
+            runs[-1][1] += 1
+        else:
+            runs.append([value, 1])
+
+    def save(self, path, **meta):
+        trace = {"version": TRACE_VERSION, "start_time": self.start_time, "clock_bases": self.clock_bases}
+        trace.update(meta)
+        with self.lock:
+            trace["streams"] = {name: {"clock": list(s["clock"]), "input": [list(r) for r in s["input"]]}
+                                for name, s in self.streams.items()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, separators=(",", ":"))
+
+
+class _StreamCursor:
+    def __init__(self, stream):
+        self.clock = iter(stream.get("clock", []))
+        self.runs = iter(stream.get("input", []))
+        self.value = None
+        self.remaining = 0
+
+
+class TraceReplayer:
+    """依照錄製的 trace 重播 time.time() 與 GPIO.input() 的值，不需要真的等待"""
+
+    def __init__(self, trace):
+        if trace.get("version") != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace version: {trace.get('version')}")
+        self.trace = trace
+        self.start_time = trace["start_time"]
+        self.clock_bases = trace["clock_bases"]
+        self.cursors = {name: _StreamCursor(stream) for name, stream in trace["streams"].items()}
+        self.lock = threading.Lock()
+        # 重播到的最晚時間 (time.time() 的值)，作為重播結束的時間
+        self.last_time = self.start_time
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _cursor(self):
+        name = threading.current_thread().name
+        with self.lock:
+            cursor = self.cursors.get(name)
+            if cursor is None:
+                cursor = self.cursors[name] = _StreamCursor({})
+        return cursor
+
+    def clock(self, kind="time"):
+        try:
+            elapsed = next(self._cursor().clock)
+        except StopIteration:
+            # 執行路徑與錄製時不同 (或已經讀完)，停止這個執行緒的重播
+            raise SystemExit("Replay trace exhausted")
+        if self.start_time + elapsed > self.last_time:
+            self.last_time = self.start_time + elapsed
+        return self.clock_bases[kind] + elapsed
+
+    def input(self):
+        cursor = self._cursor()
+        if cursor.remaining == 0:
+            try:
+                cursor.value, cursor.remaining = next(cursor.runs)
+            except StopIteration:
+                raise SystemExit("Replay trace exhausted")
+        cursor.remaining -= 1
+        return cursor.value
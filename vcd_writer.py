@@ -0,0 +1,101 @@
+import os
+import time
+import shutil
+import threading
+
+
+def _identifier(index):
+    """VCD 訊號代號：以可列印字元 (! 到 ~) 的 94 進位表示"""
+    chars = []
+    index += 1
+    while index > 0:
+        index, rem = divmod(index - 1, 94)
+        chars.append(chr(33 + rem))
+    return "".join(chars)
+
+
+class VcdWriter:
+    """
+    邊模擬邊寫出 IEEE 1364 VCD (Value Change Dump) 波形檔，可用 GTKWave 開啟。
+    - 時間單位為 1ns (整數)
+    - 每個用到的腳位一個 wire 訊號 (gpio<pin>)
+    - PWM 的 duty / frequency 以 real 訊號表示 (gpio<pin>_duty, gpio<pin>_freq)
+    因為 VCD 必須先宣告所有訊號，數值變化會先串流寫入暫存檔，結束時再接上宣告區。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.body_path = path + ".body"
+        self.body = open(self.body_path, "w", encoding="ascii")
+        self.signals = {}    # (pin, kind) -> (代號, 型別)
+        self.values = {}     # 代號 -> 最後寫入的值 (避免重複輸出)
+        self.last_time = None
+        self.closed = False
+        # 使用者程式可能從多個執行緒呼叫 GPIO，寫檔需要依序進行
+        self.lock = threading.Lock()
+
+    def _signal(self, pin, kind):
+        key = (pin, kind)
+        if key not in self.signals:
+            self.signals[key] = (_identifier(len(self.signals)), "wire" if kind == "level" else "real")
+        return self.signals[key][0]
+
+    def _change(self, pin, kind, value, t):
+        ident = self._signal(pin, kind)
+        if kind == "level":
+            text = f"{1 if value else 0}{ident}"
+        else:
+            text = f"r{float(value):.16g} {ident}"
+        if self.values.get(ident) == text:
+            return
+        self.values[ident] = text
+        # 轉為整數奈秒；VCD 的時間必須單調遞增
+        ns = max(int(round(t * 1e9)), self.last_time or 0)
+        if ns != self.last_time:
+            self.body.write(f"#{ns}\n")
+            self.last_time = ns
+        self.body.write(text + "\n")
+
+    def record(self, action, pin, value, t):
+        """
+        記錄一筆 GPIO 動作
+        :param t: 模擬開始後經過的秒數 (float，不經四捨五入)
+        """
+        if not isinstance(pin, int):
+            return
+        with self.lock:
+            if not self.closed:
+                self._record(action, pin, value, t)
+
+    def _record(self, action, pin, value, t):
+        if action in ("GPIO.output", "GPIO.input"):
+            self._change(pin, "level", value, t)
+        elif action in ("PWM.init", "PWM.ChangeFrequency"):
+            self._change(pin, "freq", value, t)
+        elif action in ("PWM.start", "PWM.ChangeDutyCycle"):
+            self._change(pin, "duty", value, t)
+        elif action == "PWM.stop":
+            self._change(pin, "duty", 0, t)
+
+    def close(self):
+        """寫出宣告區並接上數值變化，產生完整的 VCD 檔"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.body.close()
+
+        with open(self.path, "w", encoding="ascii") as f:
+            f.write(f"$date {time.strftime('%Y-%m-%d %H:%M:%S')} $end\n")
+            f.write("$version rpi-gpio-mock-runner $end\n")
+            f.write("$timescale 1ns $end\n")
+            f.write("$scope module gpio $end\n")
+            for (pin, kind), (ident, var_type) in sorted(self.signals.items()):
+                name = f"gpio{pin}" if kind == "level" else f"gpio{pin}_{kind}"
+                size = 1 if var_type == "wire" else 64
+                f.write(f"$var {var_type} {size} {ident} {name} $end\n")
+            f.write("$upscope $end\n")
+            f.write("$enddefinitions $end\n")
+            with open(self.body_path, "r", encoding="ascii") as body:
+                shutil.copyfileobj(body, f)
+        os.remove(self.body_path)